@@ -0,0 +1,191 @@
+"""
+VisionGPT - Pipeline benchmark
+Replays a recording through camera -> detector -> context and reports
+throughput, per-stage latency and drops for one or more configurations
+
+Usage:
+    python benchmark.py video.mp4
+    python benchmark.py frames/ --mode realtime \
+        --config '{"YOLO_MODEL": "yolov8s.pt"}' \
+        --config '{"PROCESS_FPS": 10, "DETECTOR_WORKERS": 2}'
+
+Each configuration runs in its own interpreter with the overrides passed
+in VISIONGPT_CONFIG, so every pipeline process sees the same settings.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Stop once the recording has ended and no context arrived for this long
+DRAIN_SECONDS = 3.0
+
+
+def run_benchmark(result_path, timeout):
+    """
+    Run the pipeline with the settings from the environment and write the
+    stats to result_path (runs inside the per-configuration interpreter)
+    """
+    from config import REORDER_MAX_WAIT_MS
+    from main import VisionGPT
+    from modules.channels import LatestValueChannel, RoundRobinReader
+    from modules.utils import LatencyTracker, create_directories, save_stats, stamp
+
+    create_directories()
+    vision_gpt = VisionGPT()
+    vision_gpt.start_pipeline()
+    cameras = [p for p in vision_gpt.processes if p.name.startswith("Camera")]
+
+    # Stand in for the VLM: take every context and record its trace
+    tracker = LatencyTracker()
+    reader = RoundRobinReader(vision_gpt.context_queues)
+    received = 0
+    published = {}   # source_id -> highest frame_id seen + 1 (ids include frames the camera skipped)
+    first_time = last_time = None
+    start_time = time.time()
+    drain = DRAIN_SECONDS + REORDER_MAX_WAIT_MS / 1000.0
+
+    try:
+        while time.time() - start_time < timeout:
+            try:
+                context_data = reader.get(timeout=0.1)
+            except queue.Empty:
+                idle_since = last_time or start_time
+                if not any(p.is_alive() for p in cameras) and time.time() - idle_since > drain:
+                    break
+                continue
+
+            stamp(context_data, 'vlm_received')
+            tracker.record(context_data['trace'])
+            tracker.throughput.tick()
+
+            received += 1
+            last_time = time.time()
+            first_time = first_time or last_time
+            source_id = context_data['source_id']
+            published[source_id] = max(published.get(source_id, 0), context_data['frame_id'] + 1)
+    finally:
+        contexts_dropped = sum(c.dropped for c in vision_gpt.context_queues
+                               if isinstance(c, LatestValueChannel))
+        vision_gpt.stop()
+
+    stats = tracker.get_stats()
+    frames_published = sum(published.values())
+    stats.update({
+        'frames': received,
+        'fps': (received - 1) / (last_time - first_time) if received > 1 else 0.0,
+        'frames_published': frames_published,
+        'frames_dropped': frames_published - received,
+        'contexts_dropped': contexts_dropped,
+    })
+    save_stats(stats, result_path)
+
+
+def run_config(overrides, timeout):
+    """
+    Run one configuration in a fresh interpreter
+
+    Returns:
+        Stats dict, or None if the run failed
+    """
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+
+    # History, keyframes and detection logs are still written, so their
+    # cost is measured, but into a scratch directory: replayed frames must
+    # not end up in the live history the query router answers from
+    scratch = tempfile.TemporaryDirectory(prefix="visiongpt-benchmark-")
+    overrides = dict(overrides,
+                     HISTORY_DIR=os.path.join(scratch.name, "history"),
+                     FRAMES_DIR=os.path.join(scratch.name, "frames"),
+                     DETECTIONS_DIR=os.path.join(scratch.name, "detections"))
+    env = dict(os.environ, VISIONGPT_CONFIG=json.dumps(overrides))
+
+    try:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--run', result_path, '--timeout', str(timeout)],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+            timeout=timeout + 60
+        )
+        with open(result_path) as f:
+            content = f.read()
+        return json.loads(content) if content else None
+    except (subprocess.TimeoutExpired, ValueError):
+        return None
+    finally:
+        os.remove(result_path)
+        scratch.cleanup()
+
+
+def print_summary(runs):
+    """Print one line per configuration"""
+    print(f"\n{'Config':<50}{'FPS':>8}{'Frames':>8}{'Dropped':>9}{'p50 e2e':>10}")
+    for run in runs:
+        stats = run['stats']
+        label = json.dumps(run['config']) if run['config'] else "(defaults)"
+        if stats is None:
+            print(f"{label:<50}{'failed':>8}")
+            continue
+        e2e = stats['stages'].get('capture_to_vlm', {}).get('p50_ms')
+        e2e_text = f"{e2e:.1f}ms" if e2e is not None else "-"
+        print(f"{label:<50}{stats['fps']:>8.1f}{stats['frames']:>8}"
+              f"{stats['frames_dropped'] + stats['contexts_dropped']:>9}{e2e_text:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the VisionGPT pipeline on a recording")
+    parser.add_argument('sources', nargs='*',
+                        help="Video files or image directories, one camera each")
+    parser.add_argument('--mode', choices=['fast', 'realtime'], default='fast',
+                        help="Replay as fast as possible or at recorded timestamps")
+    parser.add_argument('--config', action='append', default=[],
+                        help="JSON object of config.py overrides (repeat for several runs)")
+    parser.add_argument('--timeout', type=float, default=600,
+                        help="Max seconds per run")
+    parser.add_argument('--output', help="Where to save the results as JSON")
+    parser.add_argument('--run', metavar='RESULT_PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_benchmark(args.run, args.timeout)
+        return
+
+    if not args.sources:
+        parser.error("at least one source is required")
+
+    from config import BENCHMARK_FILE
+    from modules.utils import print_latency_stats, save_stats
+
+    runs = []
+    for config_text in args.config or ['{}']:
+        config = json.loads(config_text)
+        overrides = dict(config,
+                         CAMERA_SOURCES=[os.path.abspath(s) for s in args.sources],
+                         REPLAY_MODE=args.mode)
+
+        print(f"\n{'='*60}\nBenchmark: {config or '(defaults)'}\n{'='*60}")
+        stats = run_config(overrides, args.timeout)
+        runs.append({'config': config, 'stats': stats})
+
+        if stats is None:
+            print("⚠️  Run failed")
+        else:
+            print_latency_stats(stats)
+
+    print_summary(runs)
+    path = save_stats({'sources': args.sources, 'mode': args.mode, 'runs': runs},
+                      args.output or BENCHMARK_FILE)
+    print(f"\nSaved to {path}")
+
+
+if __name__ == "__main__":
+    mp.set_start_method('spawn', force=True)
+    main()
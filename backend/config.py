@@ -5,15 +5,40 @@ Centralizes all settings for easy modification
 
 # Camera Settings
 CAMERA_INDEX = 0  # Default webcam
+CAMERA_SOURCES = [CAMERA_INDEX]  # Webcam indices, video files or RTSP URLs, one camera process each
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 CAPTURE_FPS = 30  # Camera capture rate
 PROCESS_FPS = 3   # How many frames per second to process (frame sampling)
+CAMERA_BUFFER_SIZE = 1  # Driver-side frame buffer (small = lower latency)
+REPLAY_MODE = "realtime"  # Video files / image folders: 'realtime' (recorded timestamps) or 'fast'
+REPLAY_IMAGE_FPS = 10     # Frame rate assumed for image folders
 
 # YOLO Settings
 YOLO_MODEL = "yolov8n.pt"  # 'n' for nano (fastest), 's', 'm', 'l', 'x' for larger
 YOLO_CONFIDENCE = 0.5
 YOLO_IOU_THRESHOLD = 0.45
+DETECTOR_BATCH_SIZE = 1          # Frames per YOLO forward pass (1 = no batching)
+DETECTOR_BATCH_TIMEOUT_MS = 50   # Max time to wait while filling a batch
+DETECTOR_WORKERS = 1             # Detector processes shared by all cameras
+DETECTOR_BACKEND = "torch"       # 'torch' (ultralytics eager), 'onnx' (onnxruntime CPU) or 'openvino'
+DETECTOR_PRECISION = "fp32"      # 'fp32' or 'int8' (onnx/openvino only, exported on first use)
+DETECTOR_INPUT_SIZE = 640        # Model input size of the exported detector
+DETECTOR_CALIBRATION_DIR = None  # Images for ONNX int8 calibration (None = saved keyframes)
+DETECTOR_CALIBRATION_IMAGES = 64  # Max calibration images
+REORDER_MAX_WAIT_MS = 200        # How long the context stage waits for a missing frame
+
+# Scene Change Gate (reuse detections while the scene is static)
+MOTION_GATE = True
+MOTION_THRESHOLD = 4.0              # Mean gray-level difference (0-255) that counts as a change
+MOTION_DOWNSCALE_SIZE = (32, 24)    # Frames are compared at this size
+MOTION_MAX_INTERVAL_SECONDS = 2.0   # Force a full detection at least this often
+
+# Tracker Settings (stable object IDs across frames)
+TRACKER_ENABLED = True
+TRACKER_DETECT_INTERVAL = 1   # Run YOLO on every k-th frame, tracks fill in the rest
+TRACKER_IOU_THRESHOLD = 0.3   # Min IoU to match a detection to a track
+TRACKER_MAX_MISSES = 3        # YOLO frames a track may go unmatched before it is dropped
 
 # Context Builder Settings
 ON_THRESHOLD = 0.3
@@ -28,16 +53,90 @@ MAX_FRAMES_IN_WINDOW = PROCESS_FPS * CONTEXT_WINDOW_SECONDS  # 30 frames
 VLM_MODEL_PATH = "Qwen/Qwen2-VL-2B-Instruct"  # Change to your model path
 VLM_MAX_TOKENS = 512
 VLM_TEMPERATURE = 0.7
+VLM_PREFIX_CACHE = True      # Reuse image + scene prefill for questions on the same frame
+VLM_PREFIX_CACHE_MB = 1024   # Memory budget for cached prefill state (LRU eviction)
+VLM_STREAMING = True         # Send tokens to the interface as they are generated
+VLM_MAX_BATCH_SIZE = 4       # Max concurrent questions answered in one batch (1 = off)
+VLM_BATCH_WINDOW_MS = 50     # How long to wait for more questions before generating
+VLM_ANSWER_CACHE = True      # Reuse answers to the same question while the scene is unchanged
+ANSWER_CACHE_TTL_SECONDS = 30
+ANSWER_CACHE_SIZE = 256      # Max cached answers (LRU eviction)
+QUERY_ROUTER = True          # Answer counts, object lists and "what is on X" from detections, skipping the VLM
+
+# VLM Image Resolution (Qwen2-VL spends one vision token per 28x28 pixels)
+VLM_MIN_PIXELS = 32 * 28 * 28          # Processor lower bound
+VLM_MAX_PIXELS = 640 * 28 * 28         # Processor upper bound, also used for object crops
+VLM_ADAPTIVE_RESOLUTION = True         # Low-res scene for general questions, crop for named objects
+VLM_SCENE_MAX_PIXELS = 192 * 28 * 28   # Whole-frame resolution for scene-level questions
+VLM_CROP_MIN_PIXELS = 256 * 28 * 28    # Small crops are upscaled to at least this
+VLM_CROP_MARGIN = 0.15                 # Padding around the cropped boxes, as a fraction of their size
+
+# CPU Inference Profile (used when no GPU is available)
+VLM_CPU_QUANTIZATION = "int8"  # 'int8' (dynamic INT8 Linear layers), '4bit' (bitsandbytes) or 'none'
+VLM_CPU_BF16 = True            # bfloat16 weights/activations where the CPU supports it ('4bit'/'none')
+VLM_THREADS = None             # Torch threads for the VLM (None = cores left over by the detectors)
+DETECTOR_THREADS = 2           # Torch threads per detector worker (None = torch default)
+
+# Detection History (columnar store on disk)
+HISTORY_ENABLED = True
+HISTORY_DIR = "data/history"
+HISTORY_CHUNK_ROWS = 65536      # Rows per memory-mapped chunk file (~3 MB)
+HISTORY_FLUSH_SECONDS = 5.0     # How often new rows become visible to readers
+HISTORY_MAX_GAP_SECONDS = 5.0   # Sightings closer than this count as one continuous stay
+
+# Keyframe Recording (JPEGs under FRAMES_DIR)
+# Saves frames where the detected object set changes and frames used to answer a query
+KEYFRAMES_ENABLED = True
+KEYFRAME_WORKERS = 2            # JPEG encoder threads in the recorder process
+KEYFRAME_QUEUE_SIZE = 32        # Pending keyframes; new ones are dropped when full
+KEYFRAME_JPEG_QUALITY = 85
+KEYFRAME_HASH_DISTANCE = 6      # dHash bits (of 64) at or below which two frames are duplicates
+KEYFRAME_DEDUPE_WINDOW = 16     # Recent keyframes per camera a new one is compared against
+KEYFRAME_DISK_BUDGET_MB = 500   # Oldest keyframes are deleted beyond this
 
 # Queue Settings
 FRAME_QUEUE_SIZE = 10
 DETECTION_QUEUE_SIZE = 30
 CONTEXT_QUEUE_SIZE = 30
 
+# Channel Settings
+# 'latest': newest item wins, stale items are overwritten (freshest data)
+# 'queue': bounded mp.Queue of the sizes above, new items dropped when full
+FRAME_CHANNEL = "latest"     # Camera -> detector
+CONTEXT_CHANNEL = "latest"   # Context -> VLM
+CHANNEL_CAPACITY_BYTES = 1024 * 1024  # Max pickled item size for 'latest'
+
+# Shared Frame Buffer Settings
+# Frames live in a shared-memory ring; queues only carry slot references.
+# Must exceed the number of frames that can sit in the queues above
+# (640x480x3 frames are ~0.9 MB each).
+FRAME_BUFFER_SLOTS = 80
+
 # Paths
-SAVE_DETECTIONS = False  # Set True to save detection JSONs for debugging
+SAVE_DETECTIONS = False  # Set True to log detections as JSON Lines for debugging
 DETECTIONS_DIR = "data/detections"
+DETECTION_LOG_BATCH_SIZE = 256  # Records written per batch by the log thread
+DETECTION_LOG_FLUSH_SECONDS = 1.0  # Max time a record waits before its batch is written
+DETECTION_LOG_QUEUE_SIZE = 10000  # Records buffered in memory; extra ones are dropped, never waited on
+DETECTION_LOG_MAX_BYTES = 64 * 1024 * 1024  # Start a new log file past this size
+DETECTION_LOG_ROTATE_SECONDS = 3600  # ...or after this long
 FRAMES_DIR = "data/frames"
+STATS_FILE = "data/stats.json"  # Latency stats dump written by the 'stats' command
+BENCHMARK_FILE = "data/benchmark.json"  # Results written by benchmark.py
 
 # Interface
-INTERFACE_TYPE = "cli"  # 'cli' or 'gui'
\ No newline at end of file
+INTERFACE_TYPE = "cli"  # 'cli' or 'gui'
+
+# Overrides as a JSON object in VISIONGPT_CONFIG, e.g. set by benchmark.py.
+# Spawned processes inherit the environment, so every stage sees them.
+import json as _json
+import os as _os
+if _os.environ.get("VISIONGPT_CONFIG"):
+    _overrides = _json.loads(_os.environ["VISIONGPT_CONFIG"])
+    globals().update(_overrides)
+    
+    # Settings derived from others above follow their overridden inputs
+    if "CAMERA_SOURCES" not in _overrides:
+        CAMERA_SOURCES = [CAMERA_INDEX]
+    if "MAX_FRAMES_IN_WINDOW" not in _overrides:
+        MAX_FRAMES_IN_WINDOW = PROCESS_FPS * CONTEXT_WINDOW_SECONDS
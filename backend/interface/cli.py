@@ -5,6 +5,8 @@ Simple text-based interface for asking questions
 
 import sys
 import threading
+from config import STATS_FILE
+from modules.utils import print_latency_stats, save_stats
 
 
 class CLI:
@@ -18,6 +20,8 @@ class CLI:
         self.response_queue = response_queue
         self.running = False
         self.response_thread = None
+        self.next_query_id = 0
+        self.streaming = set()  # Query ids whose answer is being streamed
     
     def start(self):
         """Start CLI interface"""
@@ -37,7 +41,7 @@ class CLI:
         print("="*60)
         print("\nCamera is running and analyzing the scene...")
         print("Type your questions and press Enter.")
-        print("Commands: 'quit', 'exit', 'help'\n")
+        print("Commands: 'quit', 'exit', 'help', 'stats'\n")
     
     def _print_help(self):
         """Print help message"""
@@ -48,6 +52,9 @@ class CLI:
         print("    • 'How many people are there?'")
         print("    • 'What is on the table?'")
         print("    • 'Describe the scene'")
+        print("  - Prefix a question with @<n> to ask about camera n (default 0)")
+        print("    • '@1 Is anyone at the door?'")
+        print("  - Type 'stats' to show per-stage latency")
         print("  - Type 'quit' or 'exit' to stop")
         print()
     
@@ -56,15 +63,64 @@ class CLI:
         while self.running:
             try:
                 response_data = self.response_queue.get(timeout=0.5)
-                self._display_response(response_data)
+                if response_data.get('type') == 'stats':
+                    self._display_stats(response_data['stats'])
+                elif response_data.get('type') == 'token':
+                    self._display_token(response_data)
+                else:
+                    self._display_response(response_data)
             except:
                 continue
     
+    def _display_token(self, token_data):
+        """Display a streamed chunk of an answer as it arrives"""
+        query_id = token_data['query_id']
+        if query_id not in self.streaming:
+            self.streaming.add(query_id)
+            print("\n" + "-"*60)
+            print("Answer:")
+        print(token_data['text'], end='', flush=True)
+    
     def _display_response(self, response_data):
         """Display VLM response"""
+        frame_age = response_data.get('frame_age')
+        if frame_age is not None:
+            source = f"Frame {response_data['frame_id']}, {frame_age:.1f}s old"
+        else:
+            source = f"Frame {response_data['frame_id']}"
+        if response_data.get('source_id'):
+            source = f"Camera {response_data['source_id']}, {source}"
+        if response_data.get('cached'):
+            source += ", cached"
+        if response_data.get('from_detections'):
+            source += ", from detections"
+        
+        # A failed query may have streamed part of an answer, close it off
+        # and show the error instead
+        if response_data.get('error'):
+            if response_data.get('query_id') in self.streaming:
+                self.streaming.discard(response_data['query_id'])
+                print()
+            else:
+                print("\n" + "-"*60)
+            print(f"⚠️  {response_data['response']}")
+        # Streamed answers are already on screen, just close them off
+        elif response_data.get('query_id') in self.streaming:
+            self.streaming.discard(response_data['query_id'])
+            print(f"\n({source})")
+        else:
+            print("\n" + "-"*60)
+            print(f"Answer ({source}):")
+            print(f"{response_data['response']}")
+        print("-"*60)
+        print("\n>>> ", end='', flush=True)
+    
+    def _display_stats(self, stats):
+        """Display pipeline latency stats and dump them to JSON"""
         print("\n" + "-"*60)
-        print(f"Answer (Frame {response_data['frame_id']}):")
-        print(f"{response_data['response']}")
+        print_latency_stats(stats)
+        path = save_stats(stats, STATS_FILE)
+        print(f"Saved to {path}")
         print("-"*60)
         print("\n>>> ", end='', flush=True)
     
@@ -89,9 +145,27 @@ class CLI:
                     self._print_help()
                     continue
                 
+                if user_input.lower() == 'stats':
+                    self.query_queue.put({'type': 'stats'})
+                    continue
+                
+                # "@<n> question" picks the camera to ask about
+                source_id = 0
+                if user_input.startswith('@'):
+                    prefix, _, question = user_input[1:].partition(' ')
+                    if prefix.isdigit() and question.strip():
+                        source_id = int(prefix)
+                        user_input = question.strip()
+                
                 # Send query to VLM
                 print("Processing your question...")
-                self.query_queue.put(user_input)
+                self.query_queue.put({
+                    'type': 'query',
+                    'query_id': self.next_query_id,
+                    'question': user_input,
+                    'source_id': source_id
+                })
+                self.next_query_id += 1
                 
         except KeyboardInterrupt:
             print("\n\n👋 Interrupted by user. Shutting down...")
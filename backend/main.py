@@ -7,27 +7,44 @@ import multiprocessing as mp
 import signal
 import sys
 from config import (FRAME_QUEUE_SIZE, DETECTION_QUEUE_SIZE, 
-                   CONTEXT_QUEUE_SIZE, INTERFACE_TYPE)
+                   CONTEXT_QUEUE_SIZE, INTERFACE_TYPE,
+                   FRAME_WIDTH, FRAME_HEIGHT, FRAME_BUFFER_SLOTS,
+                   FRAME_CHANNEL, CONTEXT_CHANNEL,
+                   CAMERA_SOURCES, DETECTOR_WORKERS,
+                   KEYFRAMES_ENABLED, KEYFRAME_QUEUE_SIZE)
 
 # Import process functions
 from modules.camera import camera_process
-from modules.detector import detector_process
+from modules.detector import detector_process, export_detector_model
 from modules.context_builder import context_process
 from modules.vlm_handler import vlm_process
+from modules.recorder import recorder_process
 from interface.cli import cli_interface
 from modules.utils import create_directories
+from modules.shared_frames import SharedFrameBuffer
+from modules.channels import LatestValueChannel, create_channel
 
 
 class VisionGPT:
     """Main orchestrator for VisionGPT system"""
     
     def __init__(self):
-        # Multiprocessing queues for data flow
-        self.frame_queue = mp.Queue(maxsize=FRAME_QUEUE_SIZE)
+        # Multiprocessing channels for data flow, one frame and one context
+        # channel per camera (latest-value mailboxes or bounded queues, see config)
+        self.frame_queues = [create_channel(FRAME_CHANNEL, FRAME_QUEUE_SIZE)
+                             for _ in CAMERA_SOURCES]
         self.detection_queue = mp.Queue(maxsize=DETECTION_QUEUE_SIZE)
-        self.context_queue = mp.Queue(maxsize=CONTEXT_QUEUE_SIZE)
+        self.context_queues = [create_channel(CONTEXT_CHANNEL, CONTEXT_QUEUE_SIZE)
+                               for _ in CAMERA_SOURCES]
         self.query_queue = mp.Queue()
         self.response_queue = mp.Queue()
+        self.record_queue = mp.Queue(maxsize=KEYFRAME_QUEUE_SIZE) if KEYFRAMES_ENABLED else None
+        
+        # Shared-memory ring per camera holding the frame pixels
+        self.frame_buffers = [
+            SharedFrameBuffer(FRAME_BUFFER_SLOTS, (FRAME_HEIGHT, FRAME_WIDTH, 3))
+            for _ in CAMERA_SOURCES
+        ]
         
         # Event to signal shutdown
         self.stop_event = mp.Event()
@@ -42,39 +59,14 @@ class VisionGPT:
         # Create necessary directories
         create_directories()
         
-        # Start processes in order
-        # 1. Camera capture
-        camera_proc = mp.Process(
-            target=camera_process,
-            args=(self.frame_queue, self.stop_event),
-            name="Camera"
-        )
-        camera_proc.start()
-        self.processes.append(camera_proc)
-        
-        # 2. Object detector
-        detector_proc = mp.Process(
-            target=detector_process,
-            args=(self.frame_queue, self.detection_queue, self.stop_event),
-            name="Detector"
-        )
-        detector_proc.start()
-        self.processes.append(detector_proc)
-        
-        # 3. Context builder
-        context_proc = mp.Process(
-            target=context_process,
-            args=(self.detection_queue, self.context_queue, self.stop_event),
-            name="Context"
-        )
-        context_proc.start()
-        self.processes.append(context_proc)
+        self.start_pipeline()
         
-        # 4. VLM handler
+        # 5. VLM handler
         vlm_proc = mp.Process(
             target=vlm_process,
-            args=(self.context_queue, self.query_queue, 
-                  self.response_queue, self.stop_event),
+            args=(self.context_queues, self.query_queue, 
+                  self.response_queue, self.frame_buffers, self.stop_event,
+                  self.record_queue),
             name="VLM"
         )
         vlm_proc.start()
@@ -83,13 +75,59 @@ class VisionGPT:
         print("\n✓ All background processes started")
         print("✓ System ready!\n")
         
-        # 5. User interface (runs in main process)
+        # 6. User interface (runs in main process)
         if INTERFACE_TYPE == "cli":
             cli_interface(self.query_queue, self.response_queue, self.stop_event)
         else:
             print("GUI interface not yet implemented. Using CLI.")
             cli_interface(self.query_queue, self.response_queue, self.stop_event)
     
+    def start_pipeline(self):
+        """Start the camera, detector, context and recorder processes"""
+        # 1. Camera capture, one process per source
+        for source_id, source in enumerate(CAMERA_SOURCES):
+            camera_proc = mp.Process(
+                target=camera_process,
+                args=(source_id, source, self.frame_queues[source_id],
+                      self.frame_buffers[source_id], self.stop_event),
+                name=f"Camera-{source_id}"
+            )
+            camera_proc.start()
+            self.processes.append(camera_proc)
+        
+        # 2. Object detector pool shared by all cameras. Export the model
+        # here once so the workers don't race to write the same file
+        export_detector_model()
+        for worker_id in range(DETECTOR_WORKERS):
+            detector_proc = mp.Process(
+                target=detector_process,
+                args=(worker_id, self.frame_queues, self.detection_queue,
+                      self.frame_buffers, self.stop_event),
+                name=f"Detector-{worker_id}"
+            )
+            detector_proc.start()
+            self.processes.append(detector_proc)
+        
+        # 3. Context builder
+        context_proc = mp.Process(
+            target=context_process,
+            args=(self.detection_queue, self.context_queues, self.stop_event,
+                  self.record_queue),
+            name="Context"
+        )
+        context_proc.start()
+        self.processes.append(context_proc)
+        
+        # 4. Keyframe recorder, encodes JPEGs off the capture/detect path
+        if self.record_queue is not None:
+            recorder_proc = mp.Process(
+                target=recorder_process,
+                args=(self.record_queue, self.frame_buffers, self.stop_event),
+                name="Recorder"
+            )
+            recorder_proc.start()
+            self.processes.append(recorder_proc)
+    
     def stop(self):
         """Stop all processes gracefully"""
         print("\nStopping all processes...")
@@ -105,6 +143,15 @@ class VisionGPT:
                 proc.terminate()
                 proc.join()
         
+        # Release shared memory
+        for frame_buffer in self.frame_buffers:
+            frame_buffer.close()
+            frame_buffer.unlink()
+        for channel in self.frame_queues + self.context_queues:
+            if isinstance(channel, LatestValueChannel):
+                channel.close()
+                channel.unlink()
+        
         print("All processes stopped")
         print("\nVisionGPT shut down successfully\n")
 
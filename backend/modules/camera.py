@@ -3,96 +3,329 @@ Camera module - Handles webcam capture with frame sampling
 Runs in separate process to avoid blocking
 """
 
+import os
+import queue
 import cv2
 import time
+import threading
 import multiprocessing as mp
-from config import CAMERA_INDEX, FRAME_WIDTH, FRAME_HEIGHT, CAPTURE_FPS, PROCESS_FPS
+from modules.channels import LatestValueChannel
+from config import (FRAME_WIDTH, FRAME_HEIGHT, CAPTURE_FPS, PROCESS_FPS,
+                   CAMERA_BUFFER_SIZE, REPLAY_MODE, REPLAY_IMAGE_FPS)
+
+
+class ImageFolderCapture:
+    """
+    Minimal cv2.VideoCapture stand-in that plays a directory of images in
+    file name order at REPLAY_IMAGE_FPS
+    """
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+    
+    def __init__(self, path, fps=REPLAY_IMAGE_FPS):
+        self.paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(self.EXTENSIONS))
+        self.fps = fps
+        self.index = -1
+    
+    def isOpened(self):
+        return bool(self.paths)
+    
+    def grab(self):
+        self.index += 1
+        return self.index < len(self.paths)
+    
+    def retrieve(self):
+        frame = cv2.imread(self.paths[self.index])
+        return frame is not None, frame
+    
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+    
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return max(self.index, 0) * 1000.0 / self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.paths)
+        return 0
+    
+    def set(self, prop, value):
+        return False
+    
+    def release(self):
+        self.paths = []
+
+
+def open_source(source):
+    """
+    Open a frame source
+    
+    Args:
+        source: Webcam index, video file, image directory or stream URL
+    
+    Returns:
+        (capture, is_replay) where is_replay is True for files and folders
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        return ImageFolderCapture(source), True
+    return cv2.VideoCapture(source), isinstance(source, str) and os.path.isfile(source)
+
+
+class CameraReader:
+    """
+    Dedicated capture thread with latest-frame semantics.
+    
+    Every camera frame is grab()bed so the driver queue never fills up,
+    but only frames picked by sampling are retrieve()d (decoded). Only the
+    newest decoded frame is kept. grab() blocks until the camera delivers
+    the next frame, so the thread needs no sleep.
+    
+    Recorded sources (video files, image folders) are sampled on their
+    recorded timestamps instead of the wall clock, and are either played
+    back at those timestamps or as fast as the pipeline takes the frames.
+    """
+    def __init__(self, cap, sample_interval, replay=None):
+        """
+        Args:
+            cap: Opened cv2.VideoCapture (or ImageFolderCapture)
+            sample_interval: Seconds between decoded frames
+            replay: None for live cameras, 'realtime' to play a recording
+                at its recorded timestamps, 'fast' to play it as fast as
+                frames are read
+        """
+        self.cap = cap
+        self.sample_interval = sample_interval
+        self.replay = replay
+        self.frame_interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or CAPTURE_FPS)
+        self.cond = threading.Condition()
+        self.frame = None
+        self.timestamp = 0
+        self.seq = 0           # Number of frames decoded so far
+        self.consumed = 0      # Last seq handed out by read()
+        self.running = False
+        self.failed = False
+        self.thread = None
+    
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _media_time(self, frame_index):
+        """Recorded timestamp of the frame just grabbed, in seconds"""
+        position = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if position > 0:
+            return position / 1000.0
+        return frame_index * self.frame_interval
+    
+    def _run(self):
+        last_sample_time = None
+        start_time = time.time()
+        frame_index = 0
+        
+        while self.running:
+            if not self.cap.grab():
+                if self.replay:
+                    print("✓ Reached end of recording")
+                else:
+                    print("Failed to grab frame")
+                break
+            
+            if self.replay:
+                sample_time = self._media_time(frame_index)
+                frame_index += 1
+                if self.replay == 'realtime':
+                    # Files don't block on grab(), wait for the frame's play time
+                    delay = start_time + sample_time - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+            else:
+                sample_time = time.time()
+            
+            # Frame sampling: skip decoding until enough time has passed
+            # (with a little slack for float error in recorded timestamps)
+            if (last_sample_time is not None and
+                    sample_time - last_sample_time < self.sample_interval - 1e-6):
+                continue
+            
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                continue
+            last_sample_time = sample_time
+            
+            with self.cond:
+                if self.replay == 'fast':
+                    # Don't overwrite a frame nobody has read yet
+                    self.cond.wait_for(lambda: self.consumed >= self.seq or not self.running)
+                self.frame = frame
+                self.timestamp = time.time()
+                self.seq += 1
+                self.cond.notify_all()
+        
+        with self.cond:
+            self.failed = True
+            self.cond.notify_all()
+    
+    def read(self, last_seq, timeout=None):
+        """
+        Wait for a frame newer than last_seq
+        
+        Returns:
+            (seq, frame, timestamp), or None on timeout or when capture failed
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > last_seq or self.failed, timeout)
+            if self.seq <= last_seq:
+                return None
+            self.consumed = self.seq
+            self.cond.notify_all()
+            return self.seq, self.frame, self.timestamp
+    
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=1)
 
 
 class CameraCapture:
-    def __init__(self, frame_queue):
+    def __init__(self, source_id, source, frame_queue, frame_buffer):
         """
         Args:
-            frame_queue: multiprocessing.Queue to send captured frames
+            source_id: Index of this camera in CAMERA_SOURCES
+            source: Webcam index, video file, image directory or stream URL
+            frame_queue: multiprocessing.Queue to send frame references
+            frame_buffer: SharedFrameBuffer that holds the pixels
         """
+        self.source_id = source_id
+        self.source = source
         self.frame_queue = frame_queue
+        self.frame_buffer = frame_buffer
         self.running = False
         self.cap = None
+        self.reader = None
+        self.replay = None  # REPLAY_MODE when the source is a recording
         
         # Calculate frame sampling interval
         self.sample_interval = 1.0 / PROCESS_FPS  # seconds between processed frames
         
-    def start(self):
-        """Initialize camera and start capture loop"""
-        self.cap = cv2.VideoCapture(CAMERA_INDEX)
+    def start(self, stop_event):
+        """Initialize camera and run capture loop until stop_event is set"""
+        self.cap, is_replay = open_source(self.source)
+        self.replay = REPLAY_MODE if is_replay else None
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
         self.cap.set(cv2.CAP_PROP_FPS, CAPTURE_FPS)
+        # Small driver buffer so grabbed frames are current, not queued up
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_BUFFER_SIZE)
         
         if not self.cap.isOpened():
-            raise RuntimeError("Cannot open camera")
+            raise RuntimeError(f"Cannot open camera {self.source_id}: {self.source}")
+        
+        print(f"✓ Camera {self.source_id} initialized: {self.source} "
+              f"{FRAME_WIDTH}x{FRAME_HEIGHT} @ {CAPTURE_FPS}fps")
+        print(f"✓ Processing every {self.sample_interval:.2f}s ({PROCESS_FPS} fps)"
+              + (f", replay: {self.replay}" if self.replay else ""))
         
-        print(f"✓ Camera initialized: {FRAME_WIDTH}x{FRAME_HEIGHT} @ {CAPTURE_FPS}fps")
-        print(f"✓ Processing every {self.sample_interval:.2f}s ({PROCESS_FPS} fps)")
+        self.reader = CameraReader(self.cap, self.sample_interval, self.replay)
+        self.reader.start()
         
         self.running = True
-        self._capture_loop()
+        self._capture_loop(stop_event)
     
-    def _capture_loop(self):
-        """Main capture loop with frame sampling"""
-        last_process_time = 0
+    def _capture_loop(self, stop_event):
+        """Publish each sampled frame from the capture thread"""
+        last_seq = 0
         frame_id = 0
+        skipped = 0  # Frames skipped here since the last one sent
         
-        while self.running:
-            ret, frame = self.cap.read()
-            if not ret:
-                print("Failed to grab frame")
-                break
+        while self.running and not stop_event.is_set():
+            latest = self.reader.read(last_seq, timeout=0.1)
+            if latest is None:
+                if self.reader.failed:
+                    break
+                continue
+            last_seq, frame, current_time = latest
             
-            current_time = time.time()
+            if self.replay == 'fast':
+                self._wait_for_room(stop_event)
             
-            # Frame sampling: only process if enough time has passed
-            if current_time - last_process_time >= self.sample_interval:
-                # Don't block if queue is full, just skip this frame
-                if not self.frame_queue.full():
-                    frame_data = {
-                        'frame_id': frame_id,
-                        'timestamp': current_time,
-                        'frame': frame.copy()
-                    }
+            # Don't block if queue is full, just skip this frame
+            # (fast replays wait for room instead). Skipped frames still
+            # use up an id so downstream stages and drop stats see the gap
+            if self.replay != 'fast' and self.frame_queue.full():
+                skipped += 1
+                frame_id += 1
+            else:
+                # Camera may not honour the requested resolution
+                if frame.shape != self.frame_buffer.shape:
+                    frame = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
+                
+                # Pixels go to shared memory, the queue only carries the slot
+                frame_data = {
+                    'source_id': self.source_id,
+                    'frame_id': frame_id,
+                    'timestamp': current_time,
+                    'frame_ref': self.frame_buffer.write(frame),
+                    'skipped_before': skipped,
+                    'trace': {'capture': current_time}
+                }
+                if self.replay == 'fast':
+                    self._put_when_room(frame_data, stop_event)
+                else:
                     self.frame_queue.put(frame_data)
-                    last_process_time = current_time
-                    frame_id += 1
-            
-            # Small sleep to prevent CPU spinning
-            time.sleep(0.001)
+                frame_id += 1
+                skipped = 0
+    
+    def _wait_for_room(self, stop_event):
+        """Recorded frames aren't live, wait until the channel can take one instead of dropping"""
+        # A latest-value channel has room once its item was taken, readers
+        # signal that on the channel's condition
+        if isinstance(self.frame_queue, LatestValueChannel):
+            while not stop_event.is_set() and not self.frame_queue.wait_taken(0.1):
+                pass
+    
+    def _put_when_room(self, frame_data, stop_event):
+        """Blocking put for fast replays (timeouts only to notice stop_event)"""
+        while not stop_event.is_set():
+            try:
+                self.frame_queue.put(frame_data, timeout=0.1)
+                return
+            except queue.Full:
+                continue
     
     def stop(self):
         """Stop capture and release camera"""
         self.running = False
+        if self.reader:
+            self.reader.stop()
         if self.cap:
             self.cap.release()
-        print("✓ Camera stopped")
+        print(f"✓ Camera {self.source_id} stopped")
 
 
-def camera_process(frame_queue, stop_event):
+def camera_process(source_id, source, frame_queue, frame_buffer, stop_event):
     """
     Process function to run camera in separate process
     
     Args:
-        frame_queue: Queue to send frames
+        source_id: Index of this camera in CAMERA_SOURCES
+        source: Webcam index, video file, image directory or stream URL
+        frame_queue: Queue to send frame references
+        frame_buffer: SharedFrameBuffer to write frames into
         stop_event: Event to signal when to stop
     """
-    camera = CameraCapture(frame_queue)
+    camera = CameraCapture(source_id, source, frame_queue, frame_buffer)
     
     try:
-        camera.start()
-        
-        # Keep running until stop event is set
-        while not stop_event.is_set():
-            time.sleep(0.1)
+        # Runs until stop event is set, the camera fails or the recording ends
+        camera.start(stop_event)
             
     except KeyboardInterrupt:
         pass
     finally:
-        camera.stop()
\ No newline at end of file
+        camera.stop()
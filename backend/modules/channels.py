@@ -0,0 +1,245 @@
+"""
+Inter-process channels
+Latest-value "mailbox" channel used where a stage only needs the newest item
+"""
+
+import pickle
+import queue
+import struct
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from config import CHANNEL_CAPACITY_BYTES
+
+
+# Header: sequence counter, payload length, publish time
+_HEADER = struct.Struct('QQd')
+# Number of items already taken by readers (only touched under the lock)
+_TAKEN = struct.Struct('Q')
+_PAYLOAD_OFFSET = _HEADER.size + _TAKEN.size
+
+
+class LatestValueChannel:
+    """
+    Single-writer, latest-wins channel backed by a shared-memory seqlock slot.
+
+    put() overwrites whatever is in the slot and never blocks. get() takes
+    the newest item nobody has taken yet, so readers never work through a
+    backlog of stale items and several readers can share one channel
+    without getting the same item twice. Exposes the same put/get/full
+    calls as multiprocessing.Queue so stages can use either.
+    """
+
+    def __init__(self, capacity, name=None, condition=None):
+        """
+        Args:
+            capacity: Max pickled payload size in bytes
+            name: Name of an existing channel to attach to (None creates one)
+            condition: Shared Condition used to wake up waiting readers
+        """
+        self.capacity = capacity
+        self._owner = name is None
+
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=_PAYLOAD_OFFSET + capacity)
+            _HEADER.pack_into(self.shm.buf, 0, 0, 0, 0.0)
+            _TAKEN.pack_into(self.shm.buf, _HEADER.size, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self._cond = condition if condition is not None else mp.Condition()
+
+        # Reader-local stats
+        self.dropped = 0        # Items overwritten before any reader took them
+        self.skipped = 0        # Of those, how many came right before the last item taken
+        self.staleness = 0.0    # Age of the last item taken, in seconds
+
+    def __getstate__(self):
+        # Child processes attach to the same slot by name
+        return {
+            'name': self.shm.name,
+            'capacity': self.capacity,
+            'condition': self._cond
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state['capacity'], name=state['name'],
+                      condition=state['condition'])
+
+    def put(self, item, block=True, timeout=None):
+        """Publish an item, replacing the previous one (single writer only)"""
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.capacity:
+            raise ValueError(f"Item of {len(data)} bytes exceeds channel "
+                             f"capacity of {self.capacity} bytes")
+
+        buf = self.shm.buf
+        seq, _, _ = _HEADER.unpack_from(buf, 0)
+
+        # Odd sequence marks a write in progress
+        _HEADER.pack_into(buf, 0, seq + 1, 0, 0.0)
+        buf[_PAYLOAD_OFFSET:_PAYLOAD_OFFSET + len(data)] = data
+        _HEADER.pack_into(buf, 0, seq + 2, len(data), time.time())
+
+        with self._cond:
+            self._cond.notify_all()
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def _take(self):
+        """
+        Take the item in the slot if nobody has yet (caller holds the lock)
+
+        Returns:
+            (True, item) if an item was taken, else (False, None)
+        """
+        buf = self.shm.buf
+
+        while True:
+            seq, length, publish_time = _HEADER.unpack_from(buf, 0)
+            if seq % 2:
+                # Writer is mid-update, try again
+                time.sleep(0)
+                continue
+
+            published = seq // 2
+            taken, = _TAKEN.unpack_from(buf, _HEADER.size)
+            if published <= taken:
+                return False, None
+
+            data = bytes(buf[_PAYLOAD_OFFSET:_PAYLOAD_OFFSET + length])
+
+            # Retry if the writer touched the slot while we were copying
+            if _HEADER.unpack_from(buf, 0)[0] != seq:
+                continue
+
+            _TAKEN.pack_into(buf, _HEADER.size, published)
+            # Wake a writer waiting in wait_taken()
+            self._cond.notify_all()
+            self.skipped = published - taken - 1
+            self.dropped += self.skipped
+            self.staleness = time.time() - publish_time
+            return True, pickle.loads(data)
+
+    def get(self, block=True, timeout=None):
+        """
+        Take the newest item
+
+        Raises:
+            queue.Empty if nothing new arrives before the timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        # Readers serialize on the lock, the writer only takes it to notify
+        with self._cond:
+            while True:
+                found, item = self._take()
+                if found:
+                    return item
+                if not block:
+                    raise queue.Empty
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def full(self):
+        # Writers never have to wait, old items are simply replaced
+        return False
+
+    def empty(self):
+        seq, _, _ = _HEADER.unpack_from(self.shm.buf, 0)
+        taken, = _TAKEN.unpack_from(self.shm.buf, _HEADER.size)
+        return seq // 2 <= taken
+
+    def wait_taken(self, timeout=None):
+        """
+        Block until a reader has taken the item in the slot
+        
+        Returns:
+            True if the slot is empty, False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(self.empty, timeout)
+    
+    def close(self):
+        """Detach from the shared memory block"""
+        self.shm.close()
+
+    def unlink(self):
+        """Free the shared memory block (creator only)"""
+        if self._owner:
+            self.shm.unlink()
+
+
+class RoundRobinReader:
+    """
+    Reads from several channels in turn so a busy source can't starve the
+    others. Offers the get/get_nowait calls of a single channel.
+    """
+
+    # How long to block on one channel before checking the others again
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.next_index = 0
+        self.last_channel = None  # Channel the last item came from
+
+    def get_nowait(self):
+        for offset in range(len(self.channels)):
+            index = (self.next_index + offset) % len(self.channels)
+            try:
+                item = self.channels[index].get_nowait()
+            except queue.Empty:
+                continue
+            self.next_index = (index + 1) % len(self.channels)
+            self.last_channel = self.channels[index]
+            return item
+        raise queue.Empty
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                if not block:
+                    raise
+
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise queue.Empty
+
+            # A single channel can block for the whole wait
+            wait = remaining
+            if len(self.channels) > 1:
+                wait = self.POLL_INTERVAL if remaining is None else min(remaining, self.POLL_INTERVAL)
+            try:
+                item = self.channels[self.next_index].get(timeout=wait)
+            except queue.Empty:
+                continue
+            self.last_channel = self.channels[self.next_index]
+            self.next_index = (self.next_index + 1) % len(self.channels)
+            return item
+
+
+def create_channel(kind, maxsize):
+    """
+    Create the channel used between two pipeline stages
+
+    Args:
+        kind: 'latest' for a LatestValueChannel, 'queue' for a bounded mp.Queue
+        maxsize: Queue size when kind is 'queue'
+    """
+    if kind == "latest":
+        return LatestValueChannel(CHANNEL_CAPACITY_BYTES)
+    if kind == "queue":
+        return mp.Queue(maxsize=maxsize)
+    raise ValueError(f"Unknown channel type: {kind}")
@@ -3,16 +3,65 @@ Context Builder with Rolling Window
 Builds spatial relationships and maintains temporal context
 """
 
+import hashlib
 import numpy as np
 import time
 from collections import deque
 from config import (ON_THRESHOLD, NEAR_THRESHOLD, HORIZONTAL_ALIGNMENT_THRESHOLD,
-                   CONTEXT_WINDOW_SECONDS, MAX_FRAMES_IN_WINDOW)
+                   CONTEXT_WINDOW_SECONDS, MAX_FRAMES_IN_WINDOW,
+                   TRACKER_ENABLED, HISTORY_ENABLED)
+from modules.tracker import ObjectTracker
+from modules.reorder import ReorderBuffer
+from modules.history import HistoryStore
+from modules.utils import stamp
+
+
+# Classes other objects can be "on" (the only "on" relationships built)
+SURFACE_OBJECTS = {'table', 'desk', 'bed', 'couch', 'chair',
+                   'dining table', 'counter', 'shelf'}
+
+
+def scene_signature(objects, relationships):
+    """
+    Short hash of what a frame shows, equal for frames with the same
+    objects and relationships regardless of detection order
+    """
+    key = repr((sorted(objects), sorted(relationships)))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+class ClassWindowStats:
+    """
+    Running aggregates for one class over the frames in the rolling window.
+    Updates cost O(1) per detection, independent of the window length.
+    """
+
+    def __init__(self):
+        self.count = 0          # Detections of this class in the window
+        self.tracks = {}        # track_id -> frames in the window with that track
+
+    @property
+    def distinct(self):
+        """Number of distinct tracked objects of this class in the window"""
+        return len(self.tracks)
+
+    def add(self, count, track_ids=()):
+        self.count += count
+        for track_id in track_ids:
+            self.tracks[track_id] = self.tracks.get(track_id, 0) + 1
+
+    def remove(self, count, track_ids=()):
+        self.count -= count
+        for track_id in track_ids:
+            self.tracks[track_id] -= 1
+            if self.tracks[track_id] == 0:
+                del self.tracks[track_id]
 
 
 class ContextBuilder:
     """
     Builds spatial relationship context from YOLO detections with rolling window.
+    One builder per camera source, frames of a source arrive here serially.
     """
 
     def __init__(self):
@@ -20,11 +69,17 @@ class ContextBuilder:
         self.near_threshold = NEAR_THRESHOLD
         self.horizontal_alignment_threshold = HORIZONTAL_ALIGNMENT_THRESHOLD
         
-        # Rolling window: stores recent detection frames
+        # Rolling window: stores per-class counts of recent detection frames
         self.detection_window = deque(maxlen=MAX_FRAMES_IN_WINDOW)
+        
+        # Running aggregates, updated as frames enter and leave the window
+        self.class_stats = {}
+        
+        # Tracks live here rather than in the detector, since a source's
+        # frames may be spread over several detector workers
+        self.tracker = ObjectTracker() if TRACKER_ENABLED else None
 
-        self.surface_objects = {'table', 'desk', 'bed', 'couch', 'chair',
-                               'dining table', 'counter', 'shelf'}
+        self.surface_objects = SURFACE_OBJECTS
 
         self.holdable_objects = {'cell phone', 'bottle', 'cup', 'book',
                                 'remote', 'fork', 'knife', 'spoon', 'umbrella'}
@@ -83,99 +138,199 @@ class ContextBuilder:
         return in_horizontal and in_upper
 
     def build_relationships(self, detections):
-        relationships = []
-
-        sorted_detections = sorted(detections,
-                                   key=lambda x: (x['bbox'][2] - x['bbox'][0]) *
-                                               (x['bbox'][3] - x['bbox'][1]),
-                                   reverse=True)
-
-        for i, obj1 in enumerate(sorted_detections):
-            for j, obj2 in enumerate(sorted_detections):
-                if i == j:
-                    continue
-
-                obj1_name = obj1['class_name']
-                obj2_name = obj2['class_name']
-
-                if self.is_on(obj1, obj2):
-                    relationships.append((obj1_name, "on", obj2_name))
-                    continue
-
-                if self.is_holding(obj1, obj2):
-                    relationships.append((obj1_name, "holding", obj2_name))
-                    continue
-
-                horiz_rel = self.get_horizontal_relationship(obj1, obj2)
-                if horiz_rel:
-                    relationships.append((obj1_name, horiz_rel, obj2_name))
-
-                center1 = self.get_bbox_center(obj1['bbox'])
-                center2 = self.get_bbox_center(obj2['bbox'])
-                distance = self.calculate_distance(center1, center2)
-
-                if distance < self.near_threshold:
-                    relationships.append((obj1_name, "near", obj2_name))
+        """
+        Build pairwise relationships for all detections at once.
 
-        relationships = list(set(relationships))
-        return relationships
+        Bboxes are stacked into an (n, 4) array and every test is evaluated
+        as an (n, n) mask where entry [i, j] means obj1 = detections[i] and
+        obj2 = detections[j]. Produces the same tuples as applying is_on,
+        is_holding, get_horizontal_relationship and calculate_distance to
+        each pair.
+        """
+        n = len(detections)
+        if n < 2:
+            return []
+
+        names = [d['class_name'] for d in detections]
+        boxes = np.array([d['bbox'] for d in detections], dtype=np.float64)
+        x1, y1, x2, y2 = boxes.T
+        cx = (x1 + x2) / 2
+        cy = (y1 + y2) / 2
+
+        is_surface = np.array([name in self.surface_objects for name in names])
+        is_person = np.array([name == 'person' for name in names])
+        is_holdable = np.array([name in self.holdable_objects for name in names])
+
+        # Rows are obj1, columns are obj2
+        not_self = ~np.eye(n, dtype=bool)
+
+        # obj1 bottom close to surface top, obj1 center inside surface span
+        on = (not_self & is_surface[None, :]
+              & (np.abs(y2[:, None] - y1[None, :]) < 50)
+              & (x1[None, :] <= cx[:, None]) & (cx[:, None] <= x2[None, :]))
+
+        # Object center within the person's width and upper 70%
+        upper_region = y1 + ((y2 - y1) * 0.7)
+        holding = (not_self & ~on & is_person[:, None] & is_holdable[None, :]
+                   & (x1[:, None] <= cx[None, :]) & (cx[None, :] <= x2[:, None])
+                   & (cy[None, :] <= upper_region[:, None]))
+
+        # Horizontal and distance relationships only when neither matched
+        rest = not_self & ~on & ~holding
+
+        dx = cx[:, None] - cx[None, :]
+        dy = cy[:, None] - cy[None, :]
+        aligned = rest & (np.abs(dy) <= self.horizontal_alignment_threshold)
+        left_of = aligned & (dx < 0)
+        right_of = aligned & ~(dx < 0)
+        near = rest & (np.sqrt(dx**2 + dy**2) < self.near_threshold)
+
+        relationships = {}
+        for mask, rel in ((on, "on"), (holding, "holding"),
+                          (left_of, "left_of"), (right_of, "right_of"),
+                          (near, "near")):
+            for i, j in zip(*np.nonzero(mask)):
+                relationships[(names[i], rel, names[j])] = None
+
+        return list(relationships)
+    
+    def resolve_detections(self, detection_data):
+        """
+        Attach track IDs, or predict boxes for frames the detector skipped
+        
+        Args:
+            detection_data: Dict with 'detections', 'timestamp' and 'mode'
+                ('detect', 'reuse' or 'track') from the detector
+        
+        Returns:
+            List of detection dicts for the frame
+        """
+        if self.tracker is None:
+            return detection_data['detections']
+        
+        if detection_data.get('mode') == 'track':
+            return self.tracker.predict(detection_data['timestamp'])
+        return self.tracker.update(detection_data['detections'],
+                                   detection_data['timestamp'])
     
     def add_to_window(self, detection_data):
         """Add new detection frame to rolling window"""
-        self.detection_window.append(detection_data)
+        timestamp = detection_data['timestamp']
+        
+        class_counts = {}
+        class_tracks = {}
+        for det in detection_data['detections']:
+            obj_name = det['class_name']
+            class_counts[obj_name] = class_counts.get(obj_name, 0) + 1
+            if 'track_id' in det:
+                class_tracks.setdefault(obj_name, []).append(det['track_id'])
+        
+        entry = {
+            'timestamp': timestamp,
+            'class_counts': class_counts,
+            'class_tracks': class_tracks
+        }
+        # Evict explicitly instead of letting maxlen drop the frame silently
+        if len(self.detection_window) == self.detection_window.maxlen:
+            self._evict(self.detection_window.popleft())
+        
+        self.detection_window.append(entry)
+        for obj_name, count in class_counts.items():
+            if obj_name not in self.class_stats:
+                self.class_stats[obj_name] = ClassWindowStats()
+            self.class_stats[obj_name].add(count, class_tracks.get(obj_name, ()))
         
         # Clean old frames outside time window
         current_time = time.time()
         while (self.detection_window and 
                current_time - self.detection_window[0]['timestamp'] > CONTEXT_WINDOW_SECONDS):
-            self.detection_window.popleft()
+            self._evict(self.detection_window.popleft())
+    
+    def _evict(self, entry):
+        """Remove an evicted frame from the running class counters"""
+        for obj_name, count in entry['class_counts'].items():
+            stats = self.class_stats[obj_name]
+            stats.remove(count, entry['class_tracks'].get(obj_name, ()))
+            if stats.count == 0:
+                del self.class_stats[obj_name]
     
     def get_temporal_summary(self):
         """Get summary of objects seen in the rolling window"""
-        if not self.detection_window:
-            return {}
-        
-        object_counts = {}
-        for frame in self.detection_window:
-            for det in frame['detections']:
-                obj_name = det['class_name']
-                object_counts[obj_name] = object_counts.get(obj_name, 0) + 1
-        
-        return object_counts
-
-    def process_frame(self, detection_data, question=None):
+        return {obj_name: stats.count
+                for obj_name, stats in self.class_stats.items()}
+    
+    def get_temporal_distinct(self):
+        """Get number of distinct tracked objects per class in the rolling window"""
+        return {obj_name: stats.distinct
+                for obj_name, stats in self.class_stats.items() if stats.tracks}
+    
+    def process_frame(self, detection_data):
         """
         Process detection data and build context
         
         Args:
             detection_data: Dict with detections from YOLO
-            question: Optional user question
         
         Returns:
-            Context dict with VLM prompt and frame
+            Compact context snapshot with frame reference. The VLM prompt
+            is rendered from it at query time with build_vlm_prompt().
         """
+        detection_data['detections'] = self.resolve_detections(detection_data)
+        
         # Add to rolling window
         self.add_to_window(detection_data)
         
         detections = detection_data['detections']
         relationships = self.build_relationships(detections)
+        objects = [d['class_name'] for d in detections]
+
+        return {
+            'source_id': detection_data['source_id'],
+            'frame_id': detection_data['frame_id'],
+            'timestamp': detection_data['timestamp'],
+            'frame_ref': detection_data['frame_ref'],  # Pass frame reference to VLM
+            'num_objects': len(detections),
+            'objects': objects,
+            'confidences': [d['confidence'] for d in detections],
+            'boxes': [d['bbox'] for d in detections],
+            'relationships': relationships,
+            'scene_signature': scene_signature(objects, relationships),
+            'temporal_summary': self.get_temporal_summary(),
+            'temporal_distinct': self.get_temporal_distinct(),
+            'window_size': len(self.detection_window),
+            'trace': detection_data.get('trace', {})
+        }
 
-        # Format current frame objects
-        objects_list = [f"{d['class_name']} (confidence: {d['confidence']:.2f})"
-                       for d in detections]
-        
-        # Get temporal context
-        temporal_summary = self.get_temporal_summary()
-        temporal_text = ", ".join([f"{obj} ({count} frames)" 
-                                  for obj, count in temporal_summary.items()])
 
-        # Format relationships
-        relations_text = []
-        for obj1, rel, obj2 in relationships:
-            rel_formatted = rel.replace("_", " ")
-            relations_text.append(f"- {obj1} is {rel_formatted} {obj2}")
+def build_vlm_prompt(context_data, question=None):
+    """
+    Render the scene analysis prompt from a context snapshot
+    
+    Args:
+        context_data: Snapshot returned by ContextBuilder.process_frame
+        question: Optional user question
+    
+    Returns:
+        Prompt text for the VLM
+    """
+    # Format current frame objects
+    objects_list = [f"{name} (confidence: {conf:.2f})"
+                   for name, conf in zip(context_data['objects'],
+                                         context_data['confidences'])]
+    
+    # Format temporal context, with distinct object counts when tracking is on
+    distinct = context_data.get('temporal_distinct', {})
+    temporal_text = ", ".join([f"{obj} ({count} frames, {distinct[obj]} distinct)"
+                               if obj in distinct else f"{obj} ({count} frames)"
+                               for obj, count in context_data['temporal_summary'].items()])
 
-        vlm_prompt = f"""**Scene Analysis (Last {CONTEXT_WINDOW_SECONDS}s):**
+    # Format relationships
+    relations_text = []
+    for obj1, rel, obj2 in context_data['relationships']:
+        rel_formatted = rel.replace("_", " ")
+        relations_text.append(f"- {obj1} is {rel_formatted} {obj2}")
+
+    vlm_prompt = f"""**Scene Analysis (Last {CONTEXT_WINDOW_SECONDS}s):**
 
 **Currently Visible:** {', '.join(objects_list) if objects_list else 'No objects detected'}
 
@@ -185,51 +340,84 @@ class ContextBuilder:
 {chr(10).join(relations_text) if relations_text else "- No clear spatial relationships detected"}
 """
 
-        if question:
-            vlm_prompt += f"""
+    if question:
+        vlm_prompt += f"""
 **Question:** {question}
 
 Based on the visual scene and the analysis above, please answer the question accurately and concisely."""
 
-        return {
-            'frame_id': detection_data['frame_id'],
-            'timestamp': detection_data['timestamp'],
-            'frame': detection_data['frame'],  # Pass frame to VLM
-            'num_objects': len(detections),
-            'objects': [d['class_name'] for d in detections],
-            'relationships': relationships,
-            'vlm_prompt': vlm_prompt,
-            'window_size': len(self.detection_window)
-        }
+    return vlm_prompt
 
 
-def context_process(detection_queue, context_queue, stop_event):
+def context_process(detection_queue, context_queues, stop_event, record_queue=None):
     """
     Process function to run context builder in separate process
     
     Args:
-        detection_queue: Queue to receive detections
-        context_queue: Queue to send context data
+        detection_queue: Queue to receive detections from all detector workers
+        context_queues: Queue per camera source to send context data
         stop_event: Event to signal when to stop
+        record_queue: Optional queue to the keyframe recorder
     """
-    builder = ContextBuilder()
+    # Each camera keeps its own window and tracks, and its own reorder
+    # buffer since detector workers can finish frames out of order
+    builders = {}
+    reorder_buffers = {}
+    history = HistoryStore() if HISTORY_ENABLED else None
+    last_objects = {}  # source_id -> sorted object names of the last frame
     print(f"Context builder started (window: {CONTEXT_WINDOW_SECONDS}s)")
     
     try:
         while not stop_event.is_set():
+            # Wake up sooner while frames wait for a missing predecessor
+            waiting = any(len(buf) for buf in reorder_buffers.values())
             try:
-                detection_data = detection_queue.get(timeout=0.1)
+                detection_data = detection_queue.get(timeout=0.01 if waiting else 0.1)
+                source_id = detection_data['source_id']
+                if source_id not in reorder_buffers:
+                    reorder_buffers[source_id] = ReorderBuffer()
+                    builders[source_id] = ContextBuilder()
+                reorder_buffers[source_id].push(detection_data)
             except:
-                continue
-            
-            # Build context
-            context_data = builder.process_frame(detection_data)
+                pass
             
-            # Send to VLM handler
-            if not context_queue.full():
-                context_queue.put(context_data)
+            for source_id, reorder_buffer in reorder_buffers.items():
+                for detection_data in reorder_buffer.pop_ready():
+                    # Build context
+                    stamp(detection_data, 'context_start')
+                    context_data = builders[source_id].process_frame(detection_data)
+                    stamp(context_data, 'context_end')
+                    
+                    # Keep every frame's detections, with track ids, on disk
+                    if history is not None:
+                        history.append(detection_data)
+                    
+                    # Keyframe whenever the set of detected objects changes
+                    objects = sorted(context_data['objects'])
+                    if record_queue is not None and objects != last_objects.get(source_id):
+                        last_objects[source_id] = objects
+                        if not record_queue.full():
+                            record_queue.put({
+                                'source_id': source_id,
+                                'frame_id': context_data['frame_id'],
+                                'timestamp': context_data['timestamp'],
+                                'frame_ref': context_data['frame_ref'],
+                                'reason': 'objects',
+                                'objects': objects
+                            })
+                    
+                    # Send to VLM handler
+                    context_queue = context_queues[source_id]
+                    if not context_queue.full():
+                        context_queue.put(context_data)
             
     except KeyboardInterrupt:
         pass
     finally:
+        if history is not None:
+            history.close()
+        for source_id, reorder_buffer in reorder_buffers.items():
+            if reorder_buffer.skipped or reorder_buffer.late:
+                print(f"⚠️  Camera {source_id}: {reorder_buffer.skipped} frames skipped, "
+                      f"{reorder_buffer.late} arrived too late to reorder")
         print("Context builder stopped")
\ No newline at end of file
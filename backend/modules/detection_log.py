@@ -0,0 +1,119 @@
+"""
+Detection Log Writer
+Appends detection records to rotating JSON Lines files from a background
+thread, so the detector never waits on disk
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from config import (DETECTION_LOG_QUEUE_SIZE, DETECTION_LOG_BATCH_SIZE,
+                   DETECTION_LOG_FLUSH_SECONDS, DETECTION_LOG_MAX_BYTES,
+                   DETECTION_LOG_ROTATE_SECONDS)
+
+
+class DetectionLogWriter:
+    """
+    Buffered, rotating JSONL log.
+
+    write() only puts the record on a bounded queue and never blocks; when
+    the queue is full the record is counted as dropped. The writer thread
+    serializes records in batches of up to DETECTION_LOG_BATCH_SIZE and
+    starts a new file once the current one passes DETECTION_LOG_MAX_BYTES
+    or DETECTION_LOG_ROTATE_SECONDS.
+    """
+
+    def __init__(self, directory, prefix):
+        """
+        Args:
+            directory: Where the log files go
+            prefix: File name prefix, unique per writing process
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.queue = queue.Queue(maxsize=DETECTION_LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.written = 0
+
+        self.file = None
+        self.file_bytes = 0
+        self.file_opened = 0
+        self.file_count = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        """Queue a JSON-serializable record (never blocks)"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def _collect_batch(self):
+        """Wait up to DETECTION_LOG_FLUSH_SECONDS for a batch of records"""
+        batch = []
+        deadline = time.time() + DETECTION_LOG_FLUSH_SECONDS
+
+        while len(batch) < DETECTION_LOG_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0 and batch:
+                break
+            try:
+                batch.append(self.queue.get(timeout=max(remaining, 0.1)))
+            except queue.Empty:
+                if batch or not self.running:
+                    break
+        return batch
+
+    def _write_batch(self, batch):
+        data = "".join(json.dumps(record, separators=(',', ':')) + "\n" for record in batch)
+
+        if self.file is None or self._should_rotate():
+            self._rotate()
+
+        # One write and one flush per batch, no fsync per record
+        self.file.write(data)
+        self.file.flush()
+        self.file_bytes += len(data)
+        self.written += len(batch)
+
+    def _should_rotate(self):
+        return (self.file_bytes >= DETECTION_LOG_MAX_BYTES or
+                time.time() - self.file_opened >= DETECTION_LOG_ROTATE_SECONDS)
+
+    def _rotate(self):
+        if self.file:
+            self.file.close()
+
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f"{self.prefix}_{stamp}_{self.file_count:04d}.jsonl")
+        self.file = open(path, 'w')
+        self.file_bytes = 0
+        self.file_opened = time.time()
+        self.file_count += 1
+
+    def close(self):
+        """Write out everything still queued and close the file"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.dropped:
+            print(f"⚠️  Detection log dropped {self.dropped} records (queue full)")
@@ -4,50 +4,403 @@ Runs in separate process, receives frames and outputs detections
 """
 
 import time
-import json
 import os
+import re
+import cv2
+import numpy as np
+import torch
 from ultralytics import YOLO
+from modules.channels import RoundRobinReader
+from modules.detection_log import DetectionLogWriter
 from config import (YOLO_MODEL, YOLO_CONFIDENCE, YOLO_IOU_THRESHOLD,
-                   SAVE_DETECTIONS, DETECTIONS_DIR)
+                   FRAME_WIDTH, FRAME_HEIGHT, FRAMES_DIR,
+                   SAVE_DETECTIONS, DETECTIONS_DIR,
+                   DETECTOR_BATCH_SIZE, DETECTOR_BATCH_TIMEOUT_MS,
+                   DETECTOR_BACKEND, DETECTOR_PRECISION, DETECTOR_THREADS,
+                   DETECTOR_INPUT_SIZE, DETECTOR_CALIBRATION_DIR, DETECTOR_CALIBRATION_IMAGES,
+                   MOTION_GATE, MOTION_THRESHOLD, MOTION_DOWNSCALE_SIZE,
+                   MOTION_MAX_INTERVAL_SECONDS,
+                   TRACKER_ENABLED, TRACKER_DETECT_INTERVAL)
+
+
+def export_detector_model():
+    """
+    Path of the model to load for DETECTOR_BACKEND and DETECTOR_PRECISION
+    
+    ONNX and OpenVINO models are exported from YOLO_MODEL (and quantized
+    for int8) the first time and reused from disk afterwards. ultralytics
+    runs all of them and returns the same Results objects.
+    
+    Returns:
+        Model path for YOLO()
+    """
+    if DETECTOR_BACKEND == "torch":
+        return YOLO_MODEL
+    
+    base = os.path.splitext(YOLO_MODEL)[0]
+    int8 = DETECTOR_PRECISION == "int8"
+    # Variable batch dimension only when frames are actually batched. The
+    # file name records it, so a static batch-1 export from an earlier run
+    # is never reused for batched inference
+    dynamic = DETECTOR_BATCH_SIZE > 1
+    tag = "-dynamic" if dynamic else ""
+    
+    if DETECTOR_BACKEND == "onnx":
+        onnx_path = base + tag + ".onnx"
+        if not os.path.exists(onnx_path):
+            print(f"Exporting {YOLO_MODEL} to ONNX...")
+            exported = YOLO(YOLO_MODEL).export(format="onnx", imgsz=DETECTOR_INPUT_SIZE,
+                                               dynamic=dynamic, simplify=True)
+            os.replace(exported, onnx_path)
+        if not int8:
+            return onnx_path
+        
+        int8_path = base + tag + "-int8-qdq.onnx"
+        if not os.path.exists(int8_path):
+            quantize_onnx_static(onnx_path, int8_path)
+        return int8_path
+    
+    if DETECTOR_BACKEND == "openvino":
+        # ultralytics only recognizes directories ending in _openvino_model
+        model_dir = base + tag.replace("-", "_") + ("_int8" if int8 else "") + "_openvino_model"
+        if not os.path.exists(model_dir):
+            print(f"Exporting {YOLO_MODEL} to OpenVINO ({DETECTOR_PRECISION})...")
+            exported = YOLO(YOLO_MODEL).export(format="openvino", imgsz=DETECTOR_INPUT_SIZE,
+                                               int8=int8, dynamic=dynamic)
+            os.replace(exported, model_dir)
+        return model_dir
+    
+    raise ValueError(f"Unknown detector backend: {DETECTOR_BACKEND}")
+
+
+def letterbox(frame, size=DETECTOR_INPUT_SIZE):
+    """
+    Resize and pad a BGR frame into the model input the way ultralytics does
+    
+    Returns:
+        Float32 NCHW array of shape (1, 3, size, size), RGB in [0, 1]
+    """
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width)
+    resized = cv2.resize(frame, (round(width * scale), round(height * scale)),
+                         interpolation=cv2.INTER_LINEAR)
+    
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - resized.shape[0]) // 2
+    left = (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    
+    rgb = canvas[:, :, ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(rgb, dtype=np.float32)[None] / 255.0
+
+
+def calibration_images():
+    """
+    Image paths to calibrate INT8 activations on: DETECTOR_CALIBRATION_DIR,
+    else keyframes saved from these cameras, else the ultralytics samples
+    """
+    directories = [DETECTOR_CALIBRATION_DIR] if DETECTOR_CALIBRATION_DIR else [FRAMES_DIR]
+    for directory in directories:
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(directory)
+            for name in names if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+        )
+        if paths:
+            # Spread the picks over the whole recording
+            step = max(1, len(paths) // DETECTOR_CALIBRATION_IMAGES)
+            return paths[::step][:DETECTOR_CALIBRATION_IMAGES]
+    
+    from ultralytics.utils import ASSETS
+    print("⚠️  No frames to calibrate on, using the ultralytics sample images")
+    return sorted(str(path) for path in ASSETS.glob("*.jpg"))
+
+
+def quantize_onnx_static(onnx_path, int8_path):
+    """
+    Static INT8 quantization (QDQ, per-channel weights) of an exported YOLO
+    
+    Activation ranges are calibrated once on real frames, so inference
+    runs plain int8 convolutions. Dynamic quantization instead computes
+    scales for every layer on every frame, which is meant for
+    transformers and RNNs and is rarely faster than fp32 for a conv net.
+    The Detect head stays in float: it concatenates box coordinates (0-640)
+    and class scores (0-1) into one tensor no 8-bit scale can cover.
+    """
+    import onnx
+    from onnxruntime.quantization import (quantize_static, CalibrationDataReader,
+                                          QuantFormat, QuantType)
+    
+    model = onnx.load(onnx_path)
+    input_name = model.graph.input[0].name
+    # ultralytics names nodes /model.<layer>/..., the Detect head is the last layer
+    layers = [int(m.group(1)) for node in model.graph.node
+              for m in [re.match(r"/model\.(\d+)/", node.name)] if m]
+    head = f"/model.{max(layers)}/" if layers else None
+    exclude = [node.name for node in model.graph.node if head and node.name.startswith(head)]
+    
+    class FrameReader(CalibrationDataReader):
+        def __init__(self, paths):
+            self.paths = iter(paths)
+        
+        def get_next(self):
+            for path in self.paths:
+                frame = cv2.imread(path)
+                if frame is not None:
+                    return {input_name: letterbox(frame)}
+            return None
+    
+    paths = calibration_images()
+    print(f"Quantizing ONNX model to INT8 (calibrating on {len(paths)} images)...")
+    quantize_static(onnx_path, int8_path, FrameReader(paths),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8,
+                    nodes_to_exclude=exclude)
+
+
+def limit_backend_threads(model, model_path, threads):
+    """
+    Cap the threads of an ONNX Runtime or OpenVINO model
+    
+    ultralytics builds these sessions with every core and no thread
+    option, and torch.set_num_threads() doesn't reach them, so the
+    session it created (on the first predict) is rebuilt with the cap.
+    
+    Args:
+        model: YOLO model that has run at least once
+        model_path: Path returned by export_detector_model()
+        threads: Intra-op threads for the session
+    
+    Returns:
+        True if the cap was applied
+    """
+    backend = getattr(getattr(model, 'predictor', None), 'model', None)
+    
+    if DETECTOR_BACKEND == "onnx" and hasattr(backend, 'session'):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        backend.session = ort.InferenceSession(model_path, sess_options=options,
+                                               providers=backend.session.get_providers())
+        return True
+    
+    if DETECTOR_BACKEND == "openvino" and hasattr(backend, 'ov_compiled_model'):
+        import openvino as ov
+        xml_files = [f for f in os.listdir(model_path) if f.endswith(".xml")]
+        core = ov.Core()
+        ov_model = core.read_model(os.path.join(model_path, xml_files[0]))
+        hint = "THROUGHPUT" if DETECTOR_BATCH_SIZE > 1 else "LATENCY"
+        backend.ov_compiled_model = core.compile_model(
+            ov_model, "CPU",
+            {"PERFORMANCE_HINT": hint, "INFERENCE_NUM_THREADS": threads}
+        )
+        return True
+    
+    return False
+
+
+class SceneChangeGate:
+    """
+    Cheap scene-change test on a downscaled grayscale copy of the frame.
+    Frames that barely differ from the last keyframe can skip detection.
+    """
+    def __init__(self):
+        self.keyframe = None
+        self.keyframe_time = 0
+        self._candidate = None  # (small frame, timestamp) of the last changed frame
+    
+    def reset(self):
+        """Force a full detection on the next frame"""
+        self.keyframe = None
+    
+    def needs_detection(self, frame, timestamp):
+        """
+        Args:
+            frame: BGR frame
+            timestamp: Capture time of the frame
+        
+        Returns:
+            True if the frame differs from the keyframe. It only becomes
+            the new keyframe once accept() confirms YOLO ran on it.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, MOTION_DOWNSCALE_SIZE, interpolation=cv2.INTER_AREA)
+        
+        # Compare against the keyframe, not the previous frame, so slow
+        # drift still adds up to a change
+        changed = (self.keyframe is None or
+                   timestamp - self.keyframe_time >= MOTION_MAX_INTERVAL_SECONDS or
+                   cv2.absdiff(small, self.keyframe).mean() > MOTION_THRESHOLD)
+        
+        self._candidate = (small, timestamp) if changed else None
+        return changed
+    
+    def accept(self):
+        """Make the last changed frame the keyframe (YOLO ran on it)"""
+        if self._candidate is not None:
+            self.keyframe, self.keyframe_time = self._candidate
+            self._candidate = None
 
 
 class ObjectDetector:
-    def __init__(self, detection_queue):
+    def __init__(self, detection_queue, frame_buffers, worker_id=0):
         """
         Args:
             detection_queue: Queue to send detection results
+            frame_buffers: SharedFrameBuffer per camera source, holding the frames
+            worker_id: Index of this worker in the detector pool
         """
         self.detection_queue = detection_queue
+        self.frame_buffers = frame_buffers
+        self.worker_id = worker_id
         self.model = None
+        self.log_writer = None
+        
+        # Per-source gating state (tracking happens in the context stage)
+        self.gates = {}
+        self.frames_since_detection = {}
+        self.last_detections = {}
         
     def initialize(self):
-        """Load YOLO model"""
-        print(f"Loading YOLO model: {YOLO_MODEL}...")
-        self.model = YOLO(YOLO_MODEL)
+        """Load YOLO model for the configured backend"""
+        # Keep each worker to its share of cores so the VLM isn't starved
+        if DETECTOR_THREADS:
+            torch.set_num_threads(DETECTOR_THREADS)
+        
+        model_path = export_detector_model()
+        print(f"Loading YOLO model: {model_path} ({DETECTOR_BACKEND}, {DETECTOR_PRECISION})...")
+        self.model = YOLO(model_path, task="detect")
+        
+        # Warm-up, also creates the runtime session of exported models
+        self.model(np.zeros((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8), verbose=False)
+        if DETECTOR_THREADS and DETECTOR_BACKEND != "torch":
+            if not limit_backend_threads(self.model, model_path, DETECTOR_THREADS):
+                print(f"⚠️  Could not limit {DETECTOR_BACKEND} threads, the detector may use every core")
         print("✓ YOLO model loaded")
         
         if SAVE_DETECTIONS:
-            os.makedirs(DETECTIONS_DIR, exist_ok=True)
+            # One log per worker, written from a background thread
+            self.log_writer = DetectionLogWriter(DETECTIONS_DIR, f"detector{self.worker_id}")
+            self.log_writer.start()
     
     def detect(self, frame_data):
         """
         Run detection on a frame
         
         Args:
-            frame_data: Dict with 'frame_id', 'timestamp', 'frame'
+            frame_data: Dict with 'source_id', 'frame_id', 'timestamp', 'frame_ref'
+        
+        Returns:
+            Detection results in standardized format, or None if the
+            frame was overwritten in the shared buffer before it was read
+        """
+        results = self.detect_batch([frame_data])
+        return results[0] if results else None
+    
+    def _plan(self, source_id, frame, timestamp):
+        """
+        Decide what a frame needs: 'detect' (run YOLO), 'reuse' (static
+        scene, repeat the last YOLO detections) or 'track' (skip YOLO, the
+        context stage fills in predicted track boxes)
+        """
+        if MOTION_GATE:
+            if source_id not in self.gates:
+                self.gates[source_id] = SceneChangeGate()
+            if not self.gates[source_id].needs_detection(frame, timestamp):
+                return 'reuse'
+        
+        # First frame of a source always runs YOLO
+        since = self.frames_since_detection.get(source_id, TRACKER_DETECT_INTERVAL)
+        if TRACKER_ENABLED and since + 1 < TRACKER_DETECT_INTERVAL:
+            self.frames_since_detection[source_id] = since + 1
+            return 'track'
+        
+        # Static frames are only compared with frames YOLO has seen, so
+        # 'reuse' never repeats detections from before a change
+        if source_id in self.gates:
+            self.gates[source_id].accept()
+        self.frames_since_detection[source_id] = 0
+        return 'detect'
+    
+    def detect_batch(self, frame_data_list):
+        """
+        Run one batched YOLO forward pass over several frames
+        
+        Frames the scene-change gate considers static are not sent to YOLO,
+        they reuse the last YOLO detections of their source. With the
+        tracker on, only every TRACKER_DETECT_INTERVAL-th changed frame
+        goes to YOLO and the context stage predicts the ones in between.
+        
+        Args:
+            frame_data_list: List of dicts with 'source_id', 'frame_id',
+                'timestamp', 'frame_ref' (may mix several sources)
         
         Returns:
-            Detection results in standardized format
+            List of detection results in (source_id, frame_id) order. Frames
+            that were overwritten in the shared buffer are left out.
         """
-        frame = frame_data['frame']
+        # Zero-copy views into shared memory, decide what each frame needs
+        batch = []
+        frames = []
+        for frame_data in sorted(frame_data_list,
+                                 key=lambda x: (x['source_id'], x['frame_id'])):
+            frame_buffer = self.frame_buffers[frame_data['source_id']]
+            frame = frame_buffer.get(frame_data['frame_ref'])
+            if frame is None:
+                continue
+            
+            mode = self._plan(frame_data['source_id'], frame, frame_data['timestamp'])
+            if mode == 'detect':
+                frames.append(frame)
+            batch.append((frame_data, mode))
         
-        # Run YOLO inference
-        results = self.model(frame, 
-                           conf=YOLO_CONFIDENCE,
-                           iou=YOLO_IOU_THRESHOLD,
-                           verbose=False)[0]
+        if not batch:
+            return []
+        
+        # Run YOLO inference (one Results object per frame)
+        detect_start = time.time()
+        results_list = []
+        if frames:
+            results_list = self.model(frames, 
+                                    conf=YOLO_CONFIDENCE,
+                                    iou=YOLO_IOU_THRESHOLD,
+                                    verbose=False)
+        detect_end = time.time()
+        results_iter = iter(results_list)
+        
+        output = []
+        for frame_data, mode in batch:
+            source_id = frame_data['source_id']
+            
+            if mode == 'detect':
+                detections = self._parse_results(next(results_iter))
+                
+                # Slot was reused while YOLO was reading it, results are unreliable
+                if not self.frame_buffers[source_id].is_valid(frame_data['frame_ref']):
+                    if source_id in self.gates:
+                        self.gates[source_id].reset()
+                    self.frames_since_detection[source_id] = TRACKER_DETECT_INTERVAL
+                    continue
+                self.last_detections[source_id] = detections
+            elif mode == 'reuse':
+                # Static scene: copy the last YOLO detections of this source
+                detections = [dict(det) for det in self.last_detections.get(source_id, [])]
+            else:
+                detections = []
+            
+            detection_data = self._build_detection_data(frame_data, detections)
+            detection_data['mode'] = mode
+            # Reused and tracked frames never saw YOLO, keep them out of its timings
+            if mode == 'detect':
+                detection_data['trace'].update(detect_start=detect_start,
+                                               detect_end=detect_end)
+            output.append(detection_data)
         
-        # Convert to standard format
+        return output
+    
+    def _parse_results(self, results):
+        """Convert YOLO results for one frame to the standard format"""
         detections = []
         for box in results.boxes:
             detection = {
@@ -57,60 +410,111 @@ class ObjectDetector:
                 'bbox': box.xyxy[0].tolist()  # [x1, y1, x2, y2]
             }
             detections.append(detection)
-        
+        return detections
+    
+    def _build_detection_data(self, frame_data, detections):
+        """Package detections for one frame for the next stage"""
         detection_data = {
+            'source_id': frame_data['source_id'],
             'frame_id': frame_data['frame_id'],
+            'skipped_before': frame_data.get('skipped_before', 0),
             'timestamp': frame_data['timestamp'],
-            'frame': frame,  # Keep frame for VLM
-            'detections': detections
+            'frame_ref': frame_data['frame_ref'],  # Keep frame reference for VLM
+            'detections': detections,
+            'trace': dict(frame_data.get('trace', {}))
         }
         
-        # Optionally save to JSON for debugging
-        if SAVE_DETECTIONS:
-            json_path = os.path.join(DETECTIONS_DIR, 
-                                    f"frame_{frame_data['frame_id']:06d}.json")
-            with open(json_path, 'w') as f:
-                # Don't save frame in JSON, just detections
-                save_data = {
-                    'frame_id': frame_data['frame_id'],
-                    'timestamp': frame_data['timestamp'],
-                    'detections': detections
-                }
-                json.dump(save_data, f, indent=2)
+        # Optionally log for debugging (queued, never waits on disk)
+        if self.log_writer:
+            self.log_writer.write({
+                'source_id': frame_data['source_id'],
+                'frame_id': frame_data['frame_id'],
+                'timestamp': frame_data['timestamp'],
+                'detections': detections
+            })
         
         return detection_data
+    
+    def close(self):
+        """Flush the detection log"""
+        if self.log_writer:
+            self.log_writer.close()
+            self.log_writer = None
 
 
-def detector_process(frame_queue, detection_queue, stop_event):
+def read_frame(frame_queue, timeout):
     """
-    Process function to run detector in separate process
+    Take the next frame reference from the camera channels
+    
+    Frames a latest-value channel overwrote before anyone took them are
+    added to the camera's own skips in 'skipped_before', so the reorder
+    buffer ahead of the context builder knows those frame ids will never
+    arrive.
+    """
+    frame_data = frame_queue.get(timeout=timeout)
+    frame_data['skipped_before'] = (frame_data.get('skipped_before', 0) +
+                                    getattr(frame_queue.last_channel, 'skipped', 0))
+    return frame_data
+
+
+def collect_batch(frame_queue, first_item):
+    """
+    Drain more frames to go with first_item, up to DETECTOR_BATCH_SIZE
+    or until DETECTOR_BATCH_TIMEOUT_MS has passed
+    """
+    batch = [first_item]
+    deadline = time.time() + DETECTOR_BATCH_TIMEOUT_MS / 1000.0
+    
+    while len(batch) < DETECTOR_BATCH_SIZE:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(read_frame(frame_queue, remaining))
+        except:
+            break
+    
+    return batch
+
+
+def detector_process(worker_id, frame_queues, detection_queue, frame_buffers, stop_event):
+    """
+    Process function to run one detector worker in separate process
     
     Args:
-        frame_queue: Queue to receive frames from camera
+        worker_id: Index of this worker in the detector pool
+        frame_queues: Queue per camera source to receive frame references
         detection_queue: Queue to send detection results
+        frame_buffers: SharedFrameBuffer per camera source
         stop_event: Event to signal when to stop
     """
-    detector = ObjectDetector(detection_queue)
+    detector = ObjectDetector(detection_queue, frame_buffers, worker_id)
     detector.initialize()
     
-    print("✓ Detector process started")
+    # Take frames from the cameras in turn so no source is starved
+    frame_queue = RoundRobinReader(frame_queues)
+    
+    print(f"✓ Detector worker {worker_id} started")
     
     try:
         while not stop_event.is_set():
             # Get frame from queue (with timeout to check stop_event)
             try:
-                frame_data = frame_queue.get(timeout=0.1)
+                frame_data = read_frame(frame_queue, 0.1)
             except:
                 continue
             
-            # Run detection
-            detection_data = detector.detect(frame_data)
+            # Run detection, batching frames when DETECTOR_BATCH_SIZE > 1
+            batch = collect_batch(frame_queue, frame_data)
+            results = detector.detect_batch(batch)
             
-            # Send to next stage
-            if not detection_queue.full():
-                detection_queue.put(detection_data)
+            # Send to next stage in frame_id order per source
+            for detection_data in results:
+                if not detection_queue.full():
+                    detection_queue.put(detection_data)
             
     except KeyboardInterrupt:
         pass
     finally:
-        print("✓ Detector process stopped")
\ No newline at end of file
+        detector.close()
+        print(f"✓ Detector worker {worker_id} stopped")
\ No newline at end of file
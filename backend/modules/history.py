@@ -0,0 +1,335 @@
+"""
+Detection History Store
+Append-only columnar log of every detection, kept on disk in fixed-size
+memory-mapped chunks so hours of history can be queried in milliseconds
+"""
+
+import json
+import os
+import time
+import numpy as np
+from config import (HISTORY_DIR, HISTORY_CHUNK_ROWS, HISTORY_FLUSH_SECONDS,
+                   HISTORY_MAX_GAP_SECONDS, NEAR_THRESHOLD)
+
+
+# One row per detection
+HISTORY_DTYPE = np.dtype([
+    ('timestamp', 'f8'),
+    ('source_id', 'i2'),
+    ('frame_id', 'i8'),
+    ('class_id', 'i2'),
+    ('track_id', 'i4'),     # -1 when tracking is off
+    ('confidence', 'f4'),
+    ('bbox', 'f4', (4,)),   # [x1, y1, x2, y2]
+])
+
+MANIFEST_FILE = "index.json"
+
+
+class HistoryStore:
+    """
+    Chunked columnar detection history.
+
+    The writer (context process) fills one pre-allocated .npy chunk at a
+    time through a memmap and publishes progress in index.json every
+    HISTORY_FLUSH_SECONDS. The manifest doubles as the indexes: each chunk
+    records its time span (time index) and the class ids it contains
+    (class index), so queries only open chunks that can match. Readers in
+    other processes memory-map the chunks read-only and only look at the
+    rows the manifest says are complete.
+    """
+
+    def __init__(self, directory=HISTORY_DIR, chunk_rows=HISTORY_CHUNK_ROWS, readonly=False):
+        """
+        Args:
+            directory: Where chunks and the manifest live
+            chunk_rows: Rows per chunk file
+            readonly: Open for queries only (no appends)
+        """
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.readonly = readonly
+
+        self.chunks = []         # Manifest entries, oldest first
+        self.class_names = {}    # class_id -> class name
+        self._manifest_mtime = None
+        self._maps = {}          # Chunk file -> read-only memmap
+
+        # Writer state
+        self._chunk = None       # Manifest entry of the chunk being filled
+        self._array = None       # Its writable memmap
+        self._last_flush = time.time()
+
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    # ---- Writing ----
+
+    def append(self, detection_data):
+        """
+        Add the detections of one frame
+
+        Args:
+            detection_data: Dict with 'source_id', 'frame_id', 'timestamp'
+                and 'detections' (class_id, class_name, confidence, bbox,
+                optional track_id)
+        """
+        detections = detection_data['detections']
+        if detections:
+            rows = np.zeros(len(detections), dtype=HISTORY_DTYPE)
+            rows['timestamp'] = detection_data['timestamp']
+            rows['source_id'] = detection_data['source_id']
+            rows['frame_id'] = detection_data['frame_id']
+            rows['class_id'] = [d['class_id'] for d in detections]
+            rows['track_id'] = [d.get('track_id', -1) for d in detections]
+            rows['confidence'] = [d['confidence'] for d in detections]
+            rows['bbox'] = [d['bbox'] for d in detections]
+
+            for det in detections:
+                self.class_names[det['class_id']] = det['class_name']
+            self._write_rows(rows)
+
+        if time.time() - self._last_flush >= HISTORY_FLUSH_SECONDS:
+            self.flush()
+
+    def _write_rows(self, rows):
+        while len(rows):
+            if self._chunk is None or self._chunk['rows'] == self.chunk_rows:
+                self._start_chunk()
+
+            chunk = self._chunk
+            take = min(len(rows), self.chunk_rows - chunk['rows'])
+            part, rows = rows[:take], rows[take:]
+            self._array[chunk['rows']:chunk['rows'] + take] = part
+
+            # Frames of several cameras may interleave slightly out of order
+            if chunk['rows'] and part['timestamp'][0] < chunk['t_max']:
+                chunk['sorted'] = False
+            if not np.all(np.diff(part['timestamp']) >= 0):
+                chunk['sorted'] = False
+
+            chunk['rows'] += take
+            chunk['t_min'] = min(chunk['t_min'], float(part['timestamp'].min()))
+            chunk['t_max'] = max(chunk['t_max'], float(part['timestamp'].max()))
+            chunk['classes'] = sorted(set(chunk['classes']) | set(np.unique(part['class_id']).tolist()))
+
+    def _start_chunk(self):
+        """Close the current chunk and pre-allocate the next one"""
+        if self._array is not None:
+            self.flush()
+
+        index = len(self.chunks)
+        name = f"chunk_{index:06d}.npy"
+        self._array = np.lib.format.open_memmap(
+            os.path.join(self.directory, name), mode='w+',
+            dtype=HISTORY_DTYPE, shape=(self.chunk_rows,)
+        )
+        self._chunk = {'file': name, 'rows': 0, 't_min': float('inf'),
+                       't_max': float('-inf'), 'classes': [], 'sorted': True}
+        self.chunks.append(self._chunk)
+
+    def flush(self):
+        """Make appended rows durable and visible to readers"""
+        self._last_flush = time.time()
+        if self._array is None:
+            return
+        self._array.flush()
+
+        manifest = {
+            'class_names': {str(k): v for k, v in self.class_names.items()},
+            'chunks': [c for c in self.chunks if c['rows']]
+        }
+        # Readers must never see a half-written manifest
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+        self._array = None
+        self._maps = {}
+
+    # ---- Reading ----
+
+    def refresh(self):
+        """Reload the manifest if the writer published new rows"""
+        if self._array is not None:
+            return  # The writer's own manifest is always current
+
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+
+        with open(path) as f:
+            manifest = json.load(f)
+        self._manifest_mtime = mtime
+        self.class_names = {int(k): v for k, v in manifest['class_names'].items()}
+        self.chunks = manifest['chunks']
+
+    def class_id(self, class_name):
+        for class_id, name in self.class_names.items():
+            if name == class_name:
+                return class_id
+        return None
+
+    def _chunk_rows(self, chunk):
+        """Complete rows of a chunk, memory-mapped"""
+        array = self._maps.get(chunk['file'])
+        if array is None:
+            array = np.load(os.path.join(self.directory, chunk['file']), mmap_mode='r')
+            self._maps[chunk['file']] = array
+        return array[:chunk['rows']]
+
+    def _select(self, chunk, start, end, class_id, source_id):
+        """Rows of one chunk in [start, end] matching the filters"""
+        rows = self._chunk_rows(chunk)
+
+        # Time index within the chunk: binary search on sorted timestamps
+        if chunk['sorted']:
+            timestamps = rows['timestamp']
+            lo = 0 if start is None else np.searchsorted(timestamps, start, 'left')
+            hi = len(rows) if end is None else np.searchsorted(timestamps, end, 'right')
+            rows = rows[lo:hi]
+            mask = np.ones(len(rows), dtype=bool)
+        else:
+            mask = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                mask &= rows['timestamp'] >= start
+            if end is not None:
+                mask &= rows['timestamp'] <= end
+
+        if class_id is not None:
+            mask &= rows['class_id'] == class_id
+        if source_id is not None:
+            mask &= rows['source_id'] == source_id
+        return rows[mask]
+
+    def _candidate_chunks(self, start, end, class_id):
+        """Chunks whose time span and class set can match, oldest first"""
+        return [c for c in self.chunks
+                if (start is None or c['t_max'] >= start)
+                and (end is None or c['t_min'] <= end)
+                and (class_id is None or class_id in c['classes'])]
+
+    def query(self, start=None, end=None, class_name=None, source_id=None):
+        """
+        All detections in a time range
+
+        Args:
+            start, end: Unix time bounds (None = open)
+            class_name: Only this class
+            source_id: Only this camera
+
+        Returns:
+            Structured array with HISTORY_DTYPE, in chunk order
+        """
+        self.refresh()
+        class_id = None
+        if class_name is not None:
+            class_id = self.class_id(class_name)
+            if class_id is None:
+                return np.zeros(0, dtype=HISTORY_DTYPE)
+
+        parts = [self._select(c, start, end, class_id, source_id)
+                 for c in self._candidate_chunks(start, end, class_id)]
+        if not parts:
+            return np.zeros(0, dtype=HISTORY_DTYPE)
+        return np.concatenate(parts)
+
+    def last_seen(self, class_name, before=None, source_id=None):
+        """
+        Time a class was last detected
+
+        Returns:
+            Unix timestamp, or None if it never was
+        """
+        self.refresh()
+        class_id = self.class_id(class_name)
+        if class_id is None:
+            return None
+
+        # Newest chunks first, stop at the first one with a match
+        for chunk in reversed(self._candidate_chunks(None, before, class_id)):
+            rows = self._select(chunk, None, before, class_id, source_id)
+            if len(rows):
+                return float(rows['timestamp'].max())
+        return None
+
+    def presence(self, class_name, start=None, end=None, near=None,
+                 source_id=None, max_gap=HISTORY_MAX_GAP_SECONDS):
+        """
+        Intervals during which a class was in view
+
+        Args:
+            class_name: Class to look for
+            start, end: Unix time bounds (None = open)
+            near: Optional class name, only count frames where the object
+                overlaps or is within NEAR_THRESHOLD of one of these
+            source_id: Only this camera
+            max_gap: Sightings less than this far apart form one interval
+
+        Returns:
+            List of (start, end) timestamps, oldest first
+        """
+        rows = self.query(start, end, class_name, source_id)
+        if near is not None and len(rows):
+            rows = rows[self._near_mask(rows, self.query(start, end, near, source_id))]
+        if not len(rows):
+            return []
+
+        times = np.unique(rows['timestamp'])
+        breaks = np.flatnonzero(np.diff(times) > max_gap)
+        starts = np.concatenate(([times[0]], times[breaks + 1]))
+        ends = np.concatenate((times[breaks], [times[-1]]))
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    @staticmethod
+    def _near_mask(rows, others):
+        """For each row, whether another detection in the same frame is close to it"""
+        mask = np.zeros(len(rows), dtype=bool)
+        if not len(others):
+            return mask
+
+        # A frame is (camera, capture time): frame ids restart with every
+        # run while the store keeps growing, timestamps don't
+        for source_id in np.unique(rows['source_id']):
+            row_pos = np.flatnonzero(rows['source_id'] == source_id)
+            same = others[others['source_id'] == source_id]
+            if not len(same):
+                continue
+            same = same[np.argsort(same['timestamp'], kind='stable')]
+            mask[row_pos] = HistoryStore._near_in_frames(rows[row_pos], same)
+        return mask
+
+    @staticmethod
+    def _near_in_frames(rows, others):
+        """_near_mask for one camera, others sorted by timestamp"""
+        other_keys = others['timestamp']
+        row_keys = rows['timestamp']
+
+        # Expand to every (row, other) pair from the same frame
+        lo = np.searchsorted(other_keys, row_keys, 'left')
+        counts = np.searchsorted(other_keys, row_keys, 'right') - lo
+        row_index = np.repeat(np.arange(len(rows)), counts)
+        other_index = (np.arange(counts.sum())
+                       - np.repeat(np.cumsum(counts) - counts, counts)
+                       + np.repeat(lo, counts))
+
+        a = rows['bbox'][row_index]
+        b = others['bbox'][other_index]
+        overlap = ((a[:, 0] <= b[:, 2]) & (b[:, 0] <= a[:, 2])
+                   & (a[:, 1] <= b[:, 3]) & (b[:, 1] <= a[:, 3]))
+        center_a = (a[:, :2] + a[:, 2:]) / 2
+        center_b = (b[:, :2] + b[:, 2:]) / 2
+        close = np.hypot(*(center_a - center_b).T) < NEAR_THRESHOLD
+
+        mask = np.zeros(len(rows), dtype=bool)
+        mask[row_index[overlap | close]] = True
+        return mask
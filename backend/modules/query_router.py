@@ -0,0 +1,298 @@
+"""
+Query Router
+Answers simple structured questions (counts, object lists, "what is on X",
+"when did you last see X") straight from the context snapshot and the
+detection history, everything else goes to the VLM
+"""
+
+import re
+import time
+from modules.utils import normalize_question, format_duration
+from modules.context_builder import SURFACE_OBJECTS
+
+
+# Classes of the default YOLOv8 COCO models. Lets "how many cars" answer
+# "none" for classes the detector knows, instead of guessing about others.
+COCO_CLASSES = {
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train',
+    'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign',
+    'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
+    'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella',
+    'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard',
+    'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard',
+    'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork',
+    'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange',
+    'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair',
+    'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv',
+    'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave',
+    'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase',
+    'scissors', 'teddy bear', 'hair drier', 'toothbrush'
+}
+
+# Everyday words for class names
+ALIASES = {
+    'people': 'person', 'persons': 'person', 'human': 'person',
+    'humans': 'person', 'man': 'person', 'men': 'person',
+    'woman': 'person', 'women': 'person',
+    'phone': 'cell phone', 'phones': 'cell phone', 'mobile': 'cell phone',
+    'table': 'dining table', 'tables': 'dining table', 'desk': 'dining table',
+    'sofa': 'couch', 'television': 'tv', 'fridge': 'refrigerator',
+    'plant': 'potted plant', 'plants': 'potted plant', 'mice': 'mouse',
+    'knives': 'knife', 'ball': 'sports ball', 'glass': 'wine glass',
+}
+
+# Irregular plurals for answers
+PLURALS = {
+    'person': 'people', 'mouse': 'mice', 'knife': 'knives', 'sheep': 'sheep',
+    'skis': 'skis', 'scissors': 'scissors', 'bus': 'buses', 'bench': 'benches',
+    'couch': 'couches', 'sandwich': 'sandwiches', 'toothbrush': 'toothbrushes',
+    'hair drier': 'hair driers', 'wine glass': 'wine glasses',
+}
+
+
+def plural(name):
+    """'cup' -> 'cups', 'glass' -> 'glasses', 'person' -> 'people'"""
+    if name in PLURALS:
+        return PLURALS[name]
+    if name.endswith(('s', 'x', 'z', 'ch', 'sh')):
+        return name + 'es'
+    if name.endswith('y') and name[-2:-1] not in 'aeiou':
+        return name[:-1] + 'ies'
+    return name + 's'
+
+
+def with_article(name):
+    """'a cup', 'an apple'"""
+    return f"{'an' if name[0] in 'aeiou' else 'a'} {name}"
+
+
+def pluralize(name, count):
+    """'1 cup', '2 cups', '3 people'"""
+    if count == 1:
+        return f"1 {name}"
+    return f"{count} {plural(name)}"
+
+
+def join_names(items):
+    """'a', 'a and b', 'a, b and c'"""
+    if len(items) == 1:
+        return items[0]
+    return f"{', '.join(items[:-1])} and {items[-1]}"
+
+
+def resolve_noun(noun, known):
+    """
+    Map a noun to a class name: aliases, plurals and irregular plurals
+
+    Args:
+        noun: Word or phrase from a question, e.g. 'the men', 'glasses'
+        known: Class names that may be returned as they are
+
+    Returns:
+        Class name, or None
+    """
+    noun = re.sub(r"^(?:the|a|an|any) ", "", noun.strip())
+
+    candidates = [noun, ALIASES.get(noun)]
+    if noun.endswith('ies'):
+        candidates.append(noun[:-3] + 'y')
+    if noun.endswith('es'):
+        candidates.append(noun[:-2])
+    if noun.endswith('s'):
+        candidates.append(noun[:-1])
+    candidates += [name for name, plural in PLURALS.items() if plural == noun]
+
+    for candidate in candidates:
+        if candidate in known:
+            return candidate
+        if candidate in ALIASES:
+            return ALIASES[candidate]
+    return None
+
+
+def mentioned_classes(question, objects):
+    """
+    Detected class names a question refers to, by name, alias or plural
+
+    Args:
+        question: User's question string
+        objects: Class names detected in the frame
+
+    Returns:
+        Set of class names
+    """
+    detected = set(objects)
+    words = normalize_question(question).split()
+    found = set()
+    # Class names have up to three words ('hair drier', 'wine glass')
+    for n in (1, 2, 3):
+        for i in range(len(words) - n + 1):
+            name = resolve_noun(" ".join(words[i:i + n]), detected)
+            if name in detected:
+                found.add(name)
+    return found
+
+
+class QueryRouter:
+    """
+    Lightweight rule set for questions the detections answer exactly.
+    route() returns None for anything it doesn't recognize.
+    """
+
+    COUNT = re.compile(r"^how many (?P<noun>[a-z ]+?)"
+                       r"(?: (?:are|is|do|can) (?:there|you see|visible|in view|in the (?:frame|scene|room|picture|image))(?: now| right now)?)?"
+                       r"(?P<seen> (?:have you seen|did you see|were there)(?: recently| so far| lately)?)?$")
+    LIST = re.compile(r"^(?:what|which) (?:objects|things|items) (?:do you see|can you see|are (?:there|visible|in view))"
+                      r"|^list (?:the |all )?(?:objects|things|items)")
+    EXISTS = re.compile(r"^(?:is there|are there|do you see|can you see) (?:a |an |any )?(?P<noun>[a-z ]+?)"
+                        r"(?: (?:here|there|in view|in the (?:frame|scene|room|picture|image)))?$")
+    ON = re.compile(r"^what (?:is|s|are) (?:on|on top of) (?:the |that |this )?(?P<noun>[a-z ]+)$")
+    LAST_SEEN = [
+        re.compile(r"^when did you last see (?:a |an |the |any )?(?P<noun>[a-z ]+)$"),
+        re.compile(r"^when was the last time (?:you saw |you ve seen |you have seen )?(?:a |an |the |any )?"
+                   r"(?P<noun>[a-z ]+?)(?: was)?(?: seen| here| in view| visible)?$"),
+        re.compile(r"^when was (?:a |an |the )?(?P<noun>[a-z ]+?) last seen$"),
+    ]
+    DURATION = [
+        re.compile(r"^how long (?:was|were|has|have|did) (?:the |a |an )?(?P<noun>[a-z ]+?) "
+                   r"(?:been |stay |stayed |sit |sat |spend |spent )?"
+                   r"(?:at|near|by|next to|on|in front of) (?:the |a |an )?(?P<place>[a-z ]+)$"),
+        re.compile(r"^how long (?:was|were|has|have) (?:the |a |an )?(?P<noun>[a-z ]+?) "
+                   r"(?:been )?(?:here|in view|around|visible)$"),
+    ]
+
+    def __init__(self, history=None):
+        """
+        Args:
+            history: Optional HistoryStore for questions about the past
+        """
+        self.history = history
+        self.rules = [
+            (self.COUNT, self._answer_count),
+            (self.LIST, self._answer_list),
+            (self.EXISTS, self._answer_exists),
+            (self.ON, self._answer_on),
+        ]
+        if history is not None:
+            self.rules += [(pattern, self._answer_last_seen) for pattern in self.LAST_SEEN]
+            self.rules += [(pattern, self._answer_duration) for pattern in self.DURATION]
+
+    def route(self, question, context):
+        """
+        Answer a question from the context snapshot if a rule matches
+
+        Args:
+            question: User's question string
+            context: Snapshot from ContextBuilder.process_frame
+
+        Returns:
+            Answer text, or None if the question needs the VLM
+        """
+        if context is None:
+            return None
+
+        text = normalize_question(question)
+        for pattern, handler in self.rules:
+            match = pattern.match(text)
+            if match:
+                return handler(match, context)
+        return None
+
+    def resolve_class(self, noun, context):
+        """
+        Map a noun from the question to a class name
+
+        Returns:
+            Class name, or None if the detector can't know about it
+        """
+        return resolve_noun(noun, COCO_CLASSES | set(context['objects']))
+
+    def _answer_count(self, match, context):
+        name = self.resolve_class(match.group('noun'), context)
+        if name is None:
+            return None
+
+        if match.group('seen'):
+            # Distinct tracked objects over the rolling window
+            distinct = context.get('temporal_distinct', {})
+            if name in distinct:
+                return f"I've seen {pluralize(name, distinct[name])} recently."
+            if name in context['temporal_summary']:
+                return None  # Seen, but untracked counts would be per-frame detections
+            return f"I haven't seen any {plural(name)} recently."
+
+        count = context['objects'].count(name)
+        if count == 0:
+            return f"I don't see any {plural(name)} right now."
+        return f"I see {pluralize(name, count)}."
+
+    def _answer_list(self, match, context):
+        if not context['objects']:
+            return "I don't see any objects I can recognize right now."
+
+        counts = {}
+        for name in context['objects']:
+            counts[name] = counts.get(name, 0) + 1
+        items = [pluralize(name, count) for name, count in sorted(counts.items())]
+        return f"I can see {join_names(items)}."
+
+    def _answer_exists(self, match, context):
+        name = self.resolve_class(match.group('noun'), context)
+        if name is None:
+            return None
+
+        count = context['objects'].count(name)
+        if count == 0:
+            return f"No, I don't see any {plural(name)} right now."
+        return f"Yes, I see {pluralize(name, count)}."
+
+    def _answer_on(self, match, context):
+        name = self.resolve_class(match.group('noun'), context)
+        if name is None or name not in context['objects']:
+            # Surface not detected, the VLM may still see it
+            return None
+        if name not in SURFACE_OBJECTS:
+            # "On" is only worked out for surfaces, the VLM can see a hat on a person
+            return None
+
+        on_top = sorted({obj1 for obj1, rel, obj2 in context['relationships']
+                         if rel == "on" and obj2 == name})
+        if not on_top:
+            return f"I don't see anything on the {name}."
+        verb = "is" if len(on_top) == 1 else "are"
+        return f"The {join_names(on_top)} {verb} on the {name}."
+
+    def _answer_last_seen(self, match, context):
+        name = self.resolve_class(match.group('noun'), context)
+        if name is None:
+            return None
+        if name in context['objects']:
+            return f"I can see {pluralize(name, context['objects'].count(name))} right now."
+
+        timestamp = self.history.last_seen(name, source_id=context['source_id'])
+        if timestamp is None:
+            return f"I haven't seen any {plural(name)}."
+        clock = time.strftime('%H:%M:%S', time.localtime(timestamp))
+        return f"I last saw {with_article(name)} {format_duration(time.time() - timestamp)} ago, at {clock}."
+
+    def _answer_duration(self, match, context):
+        name = self.resolve_class(match.group('noun'), context)
+        place = match.groupdict().get('place')
+        if name is None:
+            return None
+        if place is not None:
+            place = self.resolve_class(place, context)
+            if place is None:
+                return None
+
+        intervals = self.history.presence(name, near=place, source_id=context['source_id'])
+        where = f" near the {place}" if place else " in view"
+        if not intervals:
+            return f"I haven't seen {with_article(name)}{where}."
+
+        total = sum(end - start for start, end in intervals)
+        start, end = intervals[-1]
+        clock = lambda t: time.strftime('%H:%M:%S', time.localtime(t))
+        visits = f" over {len(intervals)} visits" if len(intervals) > 1 else ""
+        return (f"The {name} was{where} for {format_duration(total)} in total{visits}, "
+                f"most recently from {clock(start)} to {clock(end)}.")
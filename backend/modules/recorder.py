@@ -0,0 +1,246 @@
+"""
+Keyframe recorder
+Runs in separate process, saves the frames worth keeping (object set
+changes, frames behind answers) as JPEGs within a disk budget
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from config import (FRAMES_DIR, KEYFRAME_WORKERS, KEYFRAME_QUEUE_SIZE,
+                   KEYFRAME_JPEG_QUALITY, KEYFRAME_HASH_DISTANCE,
+                   KEYFRAME_DEDUPE_WINDOW, KEYFRAME_DISK_BUDGET_MB)
+from modules.utils import save_frame
+
+
+INDEX_FILE = "keyframes.jsonl"
+
+
+def dhash(frame, hash_size=8):
+    """
+    Difference hash: one bit per horizontally adjacent pixel pair of a
+    tiny grayscale thumbnail, robust to noise, exposure and JPEG artifacts
+
+    Returns:
+        hash_size * hash_size bit integer
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    """Number of differing bits"""
+    return bin(a ^ b).count('1')
+
+
+class KeyframeRecorder:
+    """
+    Saves keyframes without holding up the caller.
+
+    record() copies the frame, hashes it and skips it if it looks like one
+    of the last KEYFRAME_DEDUPE_WINDOW keyframes of that camera. JPEG
+    encoding and writing happen on a thread pool. Every keyframe and every
+    answered query gets a line in keyframes.jsonl; a query about a frame
+    that duplicates a saved keyframe points at that image instead of
+    saving another, and one whose image had to be dropped is logged
+    without an image. Once the JPEGs exceed KEYFRAME_DISK_BUDGET_MB the
+    oldest are deleted.
+    """
+
+    def __init__(self, frame_buffers, directory=FRAMES_DIR):
+        """
+        Args:
+            frame_buffers: SharedFrameBuffer per camera source
+            directory: Where the JPEGs and the index go
+        """
+        self.frame_buffers = frame_buffers
+        self.directory = directory
+        self.budget = KEYFRAME_DISK_BUDGET_MB * 1024 * 1024
+        self.pool = ThreadPoolExecutor(max_workers=KEYFRAME_WORKERS)
+        self.pending = 0
+
+        self.recent = {}          # source_id -> deque of (hash, image path)
+        self.files = deque()      # (path, size), oldest first
+        self.total_bytes = 0
+        self.gone = set()         # Evicted or failed images still in self.recent
+        self.lock = threading.Lock()
+
+        # Stats
+        self.saved = 0
+        self.duplicates = 0
+        self.expired = 0          # Frame slot reused before it could be copied
+        self.evicted = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan_existing()
+        self.index = open(os.path.join(directory, INDEX_FILE), 'a')
+
+    def _scan_existing(self):
+        """Count JPEGs from earlier runs against the budget, oldest first"""
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.jpg'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(found):
+            self.files.append((path, size))
+            self.total_bytes += size
+        self._evict()
+
+    def record(self, item):
+        """
+        Save a keyframe
+
+        Args:
+            item: Dict with 'source_id', 'frame_id', 'timestamp', 'reason'
+                ('objects' or 'query'), 'objects', and either 'frame' or
+                'frame_ref'; queries also carry 'question' and 'answer'
+        """
+        frame = item.get('frame')
+        if frame is None:
+            frame = self.frame_buffers[item['source_id']].copy(item['frame_ref'])
+        if frame is None:
+            self.expired += 1
+            return
+
+        source_id = item['source_id']
+        frame_hash = dhash(frame)
+        self._forget_gone()
+        recent = self.recent.setdefault(source_id, deque(maxlen=KEYFRAME_DEDUPE_WINDOW))
+        duplicate_of = next((path for h, path in recent
+                             if hamming(h, frame_hash) <= KEYFRAME_HASH_DISTANCE), None)
+
+        entry = {
+            'time': time.time(),
+            'source_id': source_id,
+            'frame_id': item['frame_id'],
+            'timestamp': item['timestamp'],
+            'reason': item['reason'],
+            'objects': item.get('objects', []),
+            'dhash': f"{frame_hash:016x}",
+        }
+        if item['reason'] == 'query':
+            entry.update(question=item['question'], answer=item['answer'])
+
+        if duplicate_of is not None:
+            self.duplicates += 1
+            if item['reason'] == 'query':
+                # Keep the audit trail, the image is already on disk
+                entry.update(image=os.path.relpath(duplicate_of, self.directory), duplicate=True)
+                self._write_index(entry)
+            return
+
+        if self.pending >= KEYFRAME_QUEUE_SIZE:
+            # Encoders are behind, keyframes are best effort but answers
+            # keep their audit line
+            if item['reason'] == 'query':
+                entry.update(image=None, dropped=True)
+                self._write_index(entry)
+            return
+
+        day = time.strftime('%Y%m%d', time.localtime(item['timestamp']))
+        clock = time.strftime('%H%M%S', time.localtime(item['timestamp']))
+        millis = int(item['timestamp'] * 1000) % 1000
+        directory = os.path.join(self.directory, f"cam{source_id}", day)
+        filename = f"{clock}_{millis:03d}_f{item['frame_id']:06d}_{item['reason']}.jpg"
+        path = os.path.join(directory, filename)
+
+        recent.append((frame_hash, path))
+        entry['image'] = os.path.relpath(path, self.directory)
+        self._write_index(entry)
+
+        with self.lock:
+            self.pending += 1
+        self.pool.submit(self._save, frame, item['frame_id'], directory, filename)
+
+    def _save(self, frame, frame_id, directory, filename):
+        """Encode and write one JPEG (encoder thread)"""
+        try:
+            path = save_frame(frame, frame_id, directory, filename, KEYFRAME_JPEG_QUALITY)
+            size = os.path.getsize(path)
+            with self.lock:
+                self.files.append((path, size))
+                self.total_bytes += size
+                self.saved += 1
+                self._evict()
+        except Exception as e:
+            print(f"⚠️  Could not save keyframe {filename}: {e}")
+            with self.lock:
+                self.gone.add(os.path.join(directory, filename))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def _evict(self):
+        """Delete the oldest JPEGs until the budget is met (caller holds the lock)"""
+        while self.total_bytes > self.budget and self.files:
+            path, size = self.files.popleft()
+            self.total_bytes -= size
+            self.gone.add(path)
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                pass
+
+    def _forget_gone(self):
+        """Stop matching duplicates against images no longer on disk"""
+        with self.lock:
+            if not self.gone:
+                return
+            for source_id, recent in self.recent.items():
+                kept = [(h, path) for h, path in recent if path not in self.gone]
+                self.recent[source_id] = deque(kept, maxlen=KEYFRAME_DEDUPE_WINDOW)
+            self.gone.clear()
+    
+    def _write_index(self, entry):
+        self.index.write(json.dumps(entry) + "\n")
+        self.index.flush()
+
+    def close(self):
+        """Finish pending writes"""
+        self.pool.shutdown(wait=True)
+        self.index.close()
+        print(f"✓ Keyframes: {self.saved} saved, {self.duplicates} duplicates skipped, "
+              f"{self.evicted} evicted ({self.total_bytes / 1024 / 1024:.1f} MB on disk)")
+        if self.expired:
+            print(f"⚠️  {self.expired} keyframes expired before they could be copied")
+
+
+def recorder_process(record_queue, frame_buffers, stop_event):
+    """
+    Process function to run the keyframe recorder in separate process
+
+    Args:
+        record_queue: Queue receiving keyframe requests from the context
+            builder and the VLM
+        frame_buffers: SharedFrameBuffer per camera source
+        stop_event: Event to signal when to stop
+    """
+    recorder = KeyframeRecorder(frame_buffers)
+    print(f"✓ Keyframe recorder started ({FRAMES_DIR}, {KEYFRAME_DISK_BUDGET_MB} MB budget)")
+
+    try:
+        while not stop_event.is_set():
+            try:
+                item = record_queue.get(timeout=0.1)
+            except:
+                continue
+
+            recorder.record(item)
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+        print("✓ Keyframe recorder stopped")
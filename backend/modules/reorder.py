@@ -0,0 +1,80 @@
+"""
+Reorder buffer
+Detector workers finish frames out of order, this puts each camera's
+frames back in frame_id order before they reach the rolling window
+"""
+
+import time
+from config import REORDER_MAX_WAIT_MS
+
+
+class ReorderBuffer:
+    """
+    Holds detection results of one camera until every earlier frame has
+    arrived or is known to be lost.
+
+    A frame is given up on when it is reported skipped (overwritten in the
+    frame channel) or when a later frame has waited REORDER_MAX_WAIT_MS
+    for it. Frames that arrive after being given up on are discarded.
+    """
+
+    def __init__(self, max_wait=REORDER_MAX_WAIT_MS / 1000.0):
+        """
+        Args:
+            max_wait: Seconds to wait for a missing frame before skipping it
+        """
+        self.max_wait = max_wait
+        self.next_id = 0        # Next frame_id to release
+        self.pending = {}       # frame_id -> (arrival time, detection data)
+        self.lost = set()       # Ids at or after next_id that will never arrive
+
+        # Stats
+        self.skipped = 0        # Missing frames given up on after max_wait
+        self.late = 0           # Frames discarded because they came too late
+
+    def push(self, detection_data, now=None):
+        """Add a detection result, in any order"""
+        now = time.time() if now is None else now
+        frame_id = detection_data['frame_id']
+
+        if frame_id < self.next_id:
+            self.late += 1
+            return
+
+        # Frames overwritten in the channel right before this one never come
+        for lost_id in range(frame_id - detection_data.get('skipped_before', 0), frame_id):
+            if lost_id >= self.next_id:
+                self.lost.add(lost_id)
+
+        self.pending[frame_id] = (now, detection_data)
+
+    def pop_ready(self, now=None):
+        """
+        Release every frame that can go out in order
+
+        Returns:
+            List of detection results in frame_id order
+        """
+        now = time.time() if now is None else now
+        ready = []
+
+        while self.pending:
+            if self.next_id in self.pending:
+                ready.append(self.pending.pop(self.next_id)[1])
+                self.next_id += 1
+            elif self.next_id in self.lost:
+                self.lost.discard(self.next_id)
+                self.next_id += 1
+            elif now - min(t for t, _ in self.pending.values()) >= self.max_wait:
+                # Waited long enough, skip ahead to the oldest frame we have
+                oldest = min(self.pending)
+                self.skipped += oldest - self.next_id
+                self.lost = {i for i in self.lost if i > oldest}
+                self.next_id = oldest
+            else:
+                break
+
+        return ready
+
+    def __len__(self):
+        return len(self.pending)
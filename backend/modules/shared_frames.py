@@ -0,0 +1,137 @@
+"""
+Shared-memory frame ring buffer
+Frames are written once by the camera and read in place by later stages,
+so queues only carry a small slot reference instead of the pixels
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedFrameBuffer:
+    """
+    Fixed ring of frame slots backed by multiprocessing.shared_memory.
+
+    The writer stores each frame in the next slot and stamps it with a
+    generation number. Readers hold a (slot, generation) reference, which
+    stays valid until the writer wraps around and reuses the slot.
+    """
+
+    def __init__(self, num_slots, shape, dtype=np.uint8, name=None):
+        """
+        Args:
+            num_slots: Number of frames kept in the ring
+            shape: Frame shape, e.g. (height, width, 3)
+            dtype: Pixel dtype
+            name: Name of an existing buffer to attach to (None creates one)
+        """
+        self.num_slots = num_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._header_nbytes = num_slots * np.dtype(np.int64).itemsize
+        self._owner = name is None
+
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(
+                create=True,
+                size=self._header_nbytes + num_slots * self.frame_nbytes
+            )
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        # One generation per slot, -1 means empty or being written
+        self.generations = np.ndarray((num_slots,), dtype=np.int64,
+                                      buffer=self.shm.buf)
+        self.frames = np.ndarray((num_slots,) + self.shape, dtype=self.dtype,
+                                 buffer=self.shm.buf, offset=self._header_nbytes)
+
+        if self._owner:
+            self.generations[:] = -1
+
+        self._next_generation = int(self.generations.max()) + 1
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getstate__(self):
+        # Child processes attach to the same block by name
+        return {
+            'name': self.shm.name,
+            'num_slots': self.num_slots,
+            'shape': self.shape,
+            'dtype': self.dtype.str
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state['num_slots'], state['shape'],
+                      dtype=state['dtype'], name=state['name'])
+
+    def write(self, frame):
+        """
+        Copy a frame into the next slot (single writer only)
+
+        Returns:
+            Reference tuple (slot, generation)
+        """
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match "
+                             f"buffer shape {self.shape}")
+
+        generation = self._next_generation
+        slot = generation % self.num_slots
+
+        # Invalidate the slot first so readers never see a half-written frame
+        self.generations[slot] = -1
+        np.copyto(self.frames[slot], frame)
+        self.generations[slot] = generation
+
+        self._next_generation += 1
+        return (slot, generation)
+
+    def is_valid(self, ref):
+        """Check that the slot still holds the referenced frame"""
+        slot, generation = ref
+        return int(self.generations[slot]) == generation
+
+    def get(self, ref):
+        """
+        Zero-copy view of a frame
+
+        The view is only meaningful while is_valid(ref) holds, so callers
+        that use it for a while should re-check afterwards.
+
+        Returns:
+            ndarray view, or None if the slot was already reused
+        """
+        if not self.is_valid(ref):
+            return None
+        return self.frames[ref[0]]
+
+    def copy(self, ref):
+        """
+        Private copy of a frame, safe to keep after the slot is reused
+
+        Returns:
+            ndarray copy, or None if the slot was reused before or during the copy
+        """
+        view = self.get(ref)
+        if view is None:
+            return None
+        frame = view.copy()
+        if not self.is_valid(ref):
+            return None
+        return frame
+
+    def close(self):
+        """Detach from the shared memory block"""
+        # Drop the numpy views first, otherwise the mmap can't be closed
+        self.generations = None
+        self.frames = None
+        self.shm.close()
+
+    def unlink(self):
+        """Free the shared memory block (creator only)"""
+        if self._owner:
+            self.shm.unlink()
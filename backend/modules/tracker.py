@@ -0,0 +1,156 @@
+"""
+Lightweight multi-object tracker
+SORT-style IoU matching with a constant-velocity filter, gives detections
+stable track IDs and fills in frames between YOLO keyframes
+"""
+
+import numpy as np
+from config import TRACKER_IOU_THRESHOLD, TRACKER_MAX_MISSES
+
+
+def iou_matrix(boxes1, boxes2):
+    """
+    Pairwise IoU between two sets of [x1, y1, x2, y2] boxes
+
+    Returns:
+        (n, m) array
+    """
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union = area1[:, None] + area2[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+class Track:
+    """One tracked object with a constant-velocity box filter"""
+
+    # Filter gains for position and velocity corrections
+    ALPHA = 0.6
+    BETA = 0.3
+
+    def __init__(self, track_id, detection, timestamp):
+        self.track_id = track_id
+        self.class_id = detection['class_id']
+        self.class_name = detection['class_name']
+        self.confidence = detection['confidence']
+        self.bbox = np.array(detection['bbox'], dtype=np.float64)
+        self.velocity = np.zeros(4)  # Box edges, pixels per second
+        self.last_update = timestamp
+        self.misses = 0
+
+    def predict(self, timestamp):
+        """Box extrapolated to the given time"""
+        return self.bbox + self.velocity * (timestamp - self.last_update)
+
+    def update(self, detection, timestamp):
+        """Correct the filter with a matched detection"""
+        dt = timestamp - self.last_update
+        predicted = self.predict(timestamp)
+        residual = np.array(detection['bbox'], dtype=np.float64) - predicted
+
+        self.bbox = predicted + self.ALPHA * residual
+        if dt > 0:
+            self.velocity = self.velocity + self.BETA * residual / dt
+
+        self.confidence = detection['confidence']
+        self.last_update = timestamp
+        self.misses = 0
+
+
+class ObjectTracker:
+    """
+    Assigns stable track IDs to YOLO detections and propagates tracks on
+    frames where YOLO is skipped
+    """
+
+    def __init__(self):
+        self.tracks = []
+        self.next_track_id = 0
+
+    def update(self, detections, timestamp):
+        """
+        Match detections from a YOLO keyframe to existing tracks
+
+        Args:
+            detections: List of detection dicts
+            timestamp: Capture time of the frame
+
+        Returns:
+            Copies of the detections with a 'track_id' added
+        """
+        matches = self._match(detections, timestamp)
+
+        output = []
+        matched_tracks = set()
+        for det_index, det in enumerate(detections):
+            track = matches.get(det_index)
+            if track is None:
+                track = Track(self.next_track_id, det, timestamp)
+                self.next_track_id += 1
+                self.tracks.append(track)
+            else:
+                track.update(det, timestamp)
+            matched_tracks.add(track.track_id)
+            output.append(dict(det, track_id=track.track_id))
+
+        # Age out tracks that keep going unmatched
+        for track in self.tracks:
+            if track.track_id not in matched_tracks:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= TRACKER_MAX_MISSES]
+
+        return output
+
+    def predict(self, timestamp):
+        """
+        Detections for a frame without YOLO, from tracks seen on the last keyframe
+
+        Returns:
+            List of detection dicts marked 'predicted'
+        """
+        return [{
+            'class_id': track.class_id,
+            'class_name': track.class_name,
+            'confidence': track.confidence,
+            'bbox': track.predict(timestamp).tolist(),
+            'track_id': track.track_id,
+            'predicted': True
+        } for track in self.tracks if track.misses == 0]
+
+    def _match(self, detections, timestamp):
+        """
+        Greedy IoU matching between detections and predicted track boxes
+        of the same class
+
+        Returns:
+            Dict of detection index -> Track
+        """
+        if not detections or not self.tracks:
+            return {}
+
+        track_boxes = np.array([t.predict(timestamp) for t in self.tracks])
+        det_boxes = np.array([d['bbox'] for d in detections], dtype=np.float64)
+        iou = iou_matrix(det_boxes, track_boxes)
+
+        det_classes = np.array([d['class_id'] for d in detections])
+        track_classes = np.array([t.class_id for t in self.tracks])
+        iou[det_classes[:, None] != track_classes[None, :]] = 0
+
+        matches = {}
+        used_tracks = set()
+        det_idx, track_idx = np.nonzero(iou >= TRACKER_IOU_THRESHOLD)
+        order = np.argsort(-iou[det_idx, track_idx], kind='stable')
+        for k in order:
+            d, t = int(det_idx[k]), int(track_idx[k])
+            if d in matches or t in used_tracks:
+                continue
+            matches[d] = self.tracks[t]
+            used_tracks.add(t)
+
+        return matches
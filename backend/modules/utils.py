@@ -4,7 +4,13 @@ Helper functions for common operations
 """
 
 import os
+import re
 import json
+import math
+import time
+import bisect
+import threading
+from collections import deque
 from datetime import datetime
 
 
@@ -15,13 +21,26 @@ def create_directories():
         os.makedirs(d, exist_ok=True)
 
 
-def save_frame(frame, frame_id, directory='data/frames'):
-    """Save a frame as image file"""
+def save_frame(frame, frame_id, directory='data/frames', filename=None, quality=None):
+    """
+    Save a frame as image file
+    
+    Args:
+        frame: BGR image
+        frame_id: Used for the default file name
+        directory: Where to save it
+        filename: File name to use instead of frame_<id>.jpg
+        quality: JPEG quality (None = OpenCV default)
+    
+    Returns:
+        Path of the saved file
+    """
     import cv2
     os.makedirs(directory, exist_ok=True)
-    filename = f"frame_{frame_id:06d}.jpg"
+    filename = filename or f"frame_{frame_id:06d}.jpg"
     filepath = os.path.join(directory, filename)
-    cv2.imwrite(filepath, frame)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else []
+    cv2.imwrite(filepath, frame, params)
     return filepath
 
 
@@ -30,6 +49,22 @@ def format_timestamp(timestamp):
     return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
 
+def format_duration(seconds):
+    """Short human-readable duration, e.g. '45s', '3m 12s', '1h 05m'"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def normalize_question(question):
+    """Lowercase the question and drop punctuation and extra whitespace"""
+    text = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(text.split())
+
+
 def print_detection_summary(detection_data):
     """Print a summary of detections for debugging"""
     detections = detection_data['detections']
@@ -55,20 +90,15 @@ class PerformanceMonitor:
     def __init__(self, name, window_size=30):
         self.name = name
         self.window_size = window_size
-        self.times = []
+        self.times = deque(maxlen=window_size)
         self.last_time = None
     
     def tick(self):
         """Record a tick"""
-        import time
         current = time.time()
         
         if self.last_time is not None:
-            interval = current - self.last_time
-            self.times.append(interval)
-            
-            if len(self.times) > self.window_size:
-                self.times.pop(0)
+            self.times.append(current - self.last_time)
         
         self.last_time = current
     
@@ -98,4 +128,129 @@ class PerformanceMonitor:
         print(f"[{self.name}] FPS: {stats['fps']:.1f} | "
               f"Avg: {stats['avg_ms']:.1f}ms | "
               f"Min: {stats['min_ms']:.1f}ms | "
-              f"Max: {stats['max_ms']:.1f}ms")
\ No newline at end of file
+              f"Max: {stats['max_ms']:.1f}ms")
+
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram with log-spaced buckets for latency percentiles.
+    Memory stays constant no matter how many samples are recorded.
+    """
+    def __init__(self, min_ms=0.1, max_ms=120000.0, buckets_per_decade=20):
+        num_buckets = math.ceil(math.log10(max_ms / min_ms) * buckets_per_decade)
+        self.edges = [min_ms * 10 ** (i / buckets_per_decade)
+                      for i in range(num_buckets + 1)]
+        # One extra bucket on each side for under/overflow
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+    
+    def record(self, value_ms):
+        """Add one sample in milliseconds"""
+        self.counts[bisect.bisect_right(self.edges, value_ms)] += 1
+        self.count += 1
+        self.sum_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+    
+    def percentile(self, pct):
+        """Approximate percentile (upper edge of the matching bucket)"""
+        if not self.count:
+            return 0.0
+        
+        target = pct / 100.0 * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target and bucket_count:
+                if i >= len(self.edges):
+                    return self.max_ms
+                return min(self.edges[i], self.max_ms)
+        return self.max_ms
+    
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.sum_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms
+        }
+
+
+# Latency breakdown: (stage, start stamp, end stamp) in a frame's 'trace'
+TRACE_STAGES = [
+    ('camera_to_detector_wait', 'capture', 'detect_start'),
+    ('detect', 'detect_start', 'detect_end'),
+    ('detector_to_context_wait', 'detect_end', 'context_start'),
+    ('context', 'context_start', 'context_end'),
+    ('context_to_vlm_wait', 'context_end', 'vlm_received'),
+    ('capture_to_vlm', 'capture', 'vlm_received'),
+    ('frame_age_at_query', 'capture', 'query_start'),
+    ('time_to_first_token', 'query_start', 'first_token'),
+    ('generation', 'query_start', 'answer'),
+    ('capture_to_answer', 'capture', 'answer'),
+]
+
+# Stages that only exist once a query is answered; the rest of the trace
+# was already recorded when the context reached the VLM
+QUERY_STAGES = ('frame_age_at_query', 'time_to_first_token', 'generation', 'capture_to_answer')
+
+
+def stamp(frame_data, stage):
+    """Record the current time for a stage in the frame's trace"""
+    frame_data.setdefault('trace', {})[stage] = time.time()
+
+
+class LatencyTracker:
+    """Per-stage latency histograms built from frame traces"""
+    def __init__(self):
+        self.histograms = {name: LatencyHistogram() for name, _, _ in TRACE_STAGES}
+        self.throughput = PerformanceMonitor("Pipeline")
+        self.lock = threading.Lock()  # Traces may be recorded from several threads
+    
+    def record(self, trace, stages=None):
+        """
+        Record every stage whose start and end stamps are in the trace
+        
+        Args:
+            trace: Dict of stage name -> time
+            stages: Only record these stage names (None = all)
+        """
+        with self.lock:
+            for name, start, end in TRACE_STAGES:
+                if stages is not None and name not in stages:
+                    continue
+                if start in trace and end in trace:
+                    self.histograms[name].record((trace[end] - trace[start]) * 1000)
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                'pipeline_fps': self.throughput.get_fps(),
+                'stages': {name: hist.to_dict()
+                           for name, hist in self.histograms.items() if hist.count}
+            }
+
+
+def print_latency_stats(stats):
+    """Print latency stats returned by LatencyTracker.get_stats"""
+    print(f"Pipeline FPS: {stats['pipeline_fps']:.1f}")
+    for key, value in stats.items():
+        if key not in ('pipeline_fps', 'stages'):
+            print(f"{key}: {value}")
+    
+    print(f"{'Stage':<26}{'Count':>7}{'Mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for name, hist in stats['stages'].items():
+        print(f"{name:<26}{hist['count']:>7}"
+              f"{hist['mean_ms']:>8.1f}ms{hist['p50_ms']:>8.1f}ms"
+              f"{hist['p90_ms']:>8.1f}ms{hist['p99_ms']:>8.1f}ms")
+
+
+def save_stats(stats, path):
+    """Dump stats dict to a JSON file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2)
+    return path
@@ -3,40 +3,234 @@ VLM Handler for Qwen-VL model
 Manages model loading and inference with both image and text context
 """
 
+import copy
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
 import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+from transformers import (Qwen2VLForConditionalGeneration, AutoProcessor,
+                          TextIteratorStreamer, BitsAndBytesConfig)
 from qwen_vl_utils import process_vision_info
 import cv2
 from PIL import Image
 import numpy as np
-from config import VLM_MODEL_PATH, VLM_MAX_TOKENS, VLM_TEMPERATURE
+from config import (VLM_MODEL_PATH, VLM_MAX_TOKENS, VLM_TEMPERATURE,
+                   VLM_PREFIX_CACHE, VLM_PREFIX_CACHE_MB, VLM_STREAMING,
+                   VLM_MAX_BATCH_SIZE, VLM_BATCH_WINDOW_MS,
+                   VLM_ANSWER_CACHE, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIZE,
+                   QUERY_ROUTER, HISTORY_ENABLED,
+                   VLM_CPU_QUANTIZATION, VLM_CPU_BF16, VLM_THREADS,
+                   VLM_MIN_PIXELS, VLM_MAX_PIXELS, VLM_ADAPTIVE_RESOLUTION,
+                   VLM_SCENE_MAX_PIXELS, VLM_CROP_MIN_PIXELS, VLM_CROP_MARGIN,
+                   DETECTOR_WORKERS, DETECTOR_THREADS)
+from modules.context_builder import build_vlm_prompt
+from modules.channels import LatestValueChannel, RoundRobinReader
+from modules.query_router import QueryRouter, mentioned_classes
+from modules.history import HistoryStore
+from modules.utils import LatencyTracker, QUERY_STAGES, normalize_question, stamp
+
+
+NO_CONTEXT_RESPONSE = "No visual context available yet. Please wait for camera to initialize."
+FRAME_EXPIRED_RESPONSE = "The latest frame is no longer available. Please ask again."
+ERROR_RESPONSE = "Could not answer this question ({error}). Please ask again."
+
+
+def tensor_nbytes(obj):
+    """Total size of all tensors inside nested containers or KV caches"""
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, Mapping):
+        return sum(tensor_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(tensor_nbytes(v) for v in obj)
+    if hasattr(obj, 'to_legacy_cache'):
+        return tensor_nbytes(obj.to_legacy_cache())
+    return 0
+
+
+def cpu_supports_bf16():
+    """Whether the CPU has native bfloat16 matmul support (AVX512-BF16 / AMX)"""
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except Exception:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process, or None where unsupported (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PrefixCache:
+    """
+    LRU cache of processed vision inputs and prefill KV state, keyed by
+    (source_id, frame_id, image variant, prompt prefix hash) and bounded by total tensor memory
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+    
+    def put(self, key, entry):
+        if key in self.entries:
+            self.total_bytes -= self.sizes.pop(key)
+            del self.entries[key]
+        
+        size = tensor_nbytes(entry)
+        self.entries[key] = entry
+        self.sizes[key] = size
+        self.total_bytes += size
+        
+        # Evict least recently used, but always keep the newest entry
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, _ = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(old_key)
+
+
+class AnswerCache:
+    """
+    LRU cache of generated answers keyed by (source_id, scene signature,
+    normalized question). Entries expire after a TTL so answers that
+    depend on more than the detected objects don't live forever.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (created, response)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and time.time() - entry[0] > self.ttl:
+            del self.entries[key]
+            entry = None
+        
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, key, response):
+        self.entries[key] = (time.time(), response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
 
 
 class VLMHandler:
-    def __init__(self):
+    def __init__(self, frame_buffers):
+        """
+        Args:
+            frame_buffers: SharedFrameBuffer per camera source, holding the frames
+        """
+        self.frame_buffers = frame_buffers
         self.model = None
         self.processor = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.latest_context = None
+        self.latest_contexts = {}  # source_id -> newest context snapshot
+        self.last_frame = None     # (source_id, frame_id, frame) of the last VLM answer
+        self.prefix_cache = PrefixCache(VLM_PREFIX_CACHE_MB * 1024 * 1024) if VLM_PREFIX_CACHE else None
         
     def initialize(self):
         """Load Qwen-VL model"""
         print(f"Loading VLM model: {VLM_MODEL_PATH}...")
         print(f"Using device: {self.device}")
         
-        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
-            VLM_MODEL_PATH,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            device_map="auto" if self.device == "cuda" else None
-        )
+        if self.device == "cuda":
+            self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+                VLM_MODEL_PATH,
+                torch_dtype=torch.float16,
+                device_map="auto"
+            )
+        else:
+            self.model = self._load_cpu_model()
         
-        self.processor = AutoProcessor.from_pretrained(VLM_MODEL_PATH)
+        # Bounds on the resized image, and with it the number of vision tokens
+        self.processor = AutoProcessor.from_pretrained(
+            VLM_MODEL_PATH, min_pixels=VLM_MIN_PIXELS, max_pixels=VLM_MAX_PIXELS
+        )
+        # Batched generation needs prompts aligned on the right
+        self.processor.tokenizer.padding_side = "left"
         
         print("✓ VLM model loaded")
     
+    def _load_cpu_model(self):
+        """
+        Load the model with the CPU inference profile: thread count split
+        with the detectors, then INT8 dynamic quantization, 4-bit weights
+        or plain bf16/fp32 depending on VLM_CPU_QUANTIZATION
+        """
+        threads = VLM_THREADS
+        if threads is None:
+            # Leave the detector workers their cores
+            threads = (os.cpu_count() or 1) - DETECTOR_WORKERS * (DETECTOR_THREADS or 1)
+        torch.set_num_threads(max(1, threads))
+        
+        dtype = torch.bfloat16 if VLM_CPU_BF16 and cpu_supports_bf16() else torch.float32
+        print(f"CPU profile: {VLM_CPU_QUANTIZATION}, {dtype}, {torch.get_num_threads()} threads")
+        
+        if VLM_CPU_QUANTIZATION == "int8":
+            # Quantized Linear layers take fp32 activations
+            model = Qwen2VLForConditionalGeneration.from_pretrained(
+                VLM_MODEL_PATH, torch_dtype=torch.float32, low_cpu_mem_usage=True
+            )
+            # In place: the default deep copy would briefly double the fp32 footprint
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+        elif VLM_CPU_QUANTIZATION == "4bit":
+            model = Qwen2VLForConditionalGeneration.from_pretrained(
+                VLM_MODEL_PATH,
+                quantization_config=BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=dtype
+                ),
+                device_map="cpu"
+            )
+        elif VLM_CPU_QUANTIZATION == "none":
+            model = Qwen2VLForConditionalGeneration.from_pretrained(
+                VLM_MODEL_PATH, torch_dtype=dtype, low_cpu_mem_usage=True
+            )
+        else:
+            raise ValueError(f"Unknown VLM CPU quantization: {VLM_CPU_QUANTIZATION}")
+        
+        model.eval()
+        print(f"✓ Model weights: {tensor_nbytes(model.state_dict()) / 1024**3:.2f} GB")
+        peak = peak_rss_bytes()
+        if peak is not None:
+            print(f"✓ Peak memory while loading: {peak / 1024**3:.2f} GB")
+        return model
+    
     def update_context(self, context_data):
         """Store latest context from context builder"""
-        self.latest_context = context_data
+        # Single reference assignment, safe to call from the receiver thread
+        self.latest_contexts[context_data['source_id']] = context_data
+    
+    def get_context(self, source_id=0):
+        """Latest context of a camera source, or None if none arrived yet"""
+        return self.latest_contexts.get(source_id)
     
     def frame_to_pil(self, frame):
         """Convert OpenCV frame to PIL Image"""
@@ -44,49 +238,191 @@ class VLMHandler:
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         return Image.fromarray(frame_rgb)
     
-    def query(self, question):
+    def prepare_image(self, frame, context, question):
         """
-        Answer a question using latest frame and context
+        Crop and size the frame for a question
+        
+        Questions that name a detected object get a high-resolution crop
+        around those objects, other questions get the whole frame at the
+        lower scene resolution.
         
         Args:
+            frame: BGR frame
+            context: Context snapshot the frame belongs to
             question: User's question string
         
         Returns:
-            Model's response text
+            (pil_image, image_options, variant, note): the image, its
+            min/max pixel limits for the chat message, a hashable id of
+            the variant for the prefix cache, and a prompt note about the
+            crop ('' for the whole frame)
         """
-        if self.latest_context is None:
-            return "No visual context available yet. Please wait for camera to initialize."
+        if not VLM_ADAPTIVE_RESOLUTION:
+            return self.frame_to_pil(frame), {'max_pixels': VLM_MAX_PIXELS}, 'full', ''
+        
+        names = mentioned_classes(question, context['objects'])
+        boxes = [box for name, box in zip(context['objects'], context.get('boxes', []))
+                 if name in names]
+        if not boxes:
+            return self.frame_to_pil(frame), {'max_pixels': VLM_SCENE_MAX_PIXELS}, 'scene', ''
         
-        # Get frame and convert to PIL
-        frame = self.latest_context['frame']
-        pil_image = self.frame_to_pil(frame)
+        # Union of the named objects' boxes, padded and clipped to the frame
+        boxes = np.array(boxes)
+        x1, y1 = boxes[:, :2].min(axis=0)
+        x2, y2 = boxes[:, 2:].max(axis=0)
+        pad_x = (x2 - x1) * VLM_CROP_MARGIN
+        pad_y = (y2 - y1) * VLM_CROP_MARGIN
+        height, width = frame.shape[:2]
+        x1, x2 = int(max(0, x1 - pad_x)), int(min(width, x2 + pad_x))
+        y1, y2 = int(max(0, y1 - pad_y)), int(min(height, y2 + pad_y))
+        if x2 - x1 < 28 or y2 - y1 < 28:
+            return self.frame_to_pil(frame), {'max_pixels': VLM_SCENE_MAX_PIXELS}, 'scene', ''
         
-        # Get text context from context builder
-        text_context = self.latest_context['vlm_prompt']
+        options = {'min_pixels': VLM_CROP_MIN_PIXELS, 'max_pixels': VLM_MAX_PIXELS}
+        note = f"\n\n(The image is a close-up of the region with the {', '.join(sorted(names))}.)"
+        return (self.frame_to_pil(frame[y1:y2, x1:x2]), options,
+                ('crop', x1, y1, x2, y2), note)
+    
+    def build_messages(self, pil_image, text, **image_options):
+        """
+        Construct message for Qwen-VL
         
-        # Construct message for Qwen-VL
+        Args:
+            pil_image: Image for the message
+            text: Prompt text
+            image_options: Per-image 'min_pixels' / 'max_pixels' limits
+        """
         # Qwen-VL expects messages in format with image and text
-        messages = [
+        return [
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "image",
-                        "image": pil_image
+                        "image": pil_image,
+                        **image_options
                     },
                     {
                         "type": "text",
-                        "text": f"{text_context}\n\n{question}"
+                        "text": text
                     }
                 ]
             }
         ]
+    
+    def query_batch(self, questions, context=None):
+        """
+        Answer several questions about the same frame in one padded batch
+        
+        All rows share one image, converted and resized once: the crop
+        when every question names the same objects, else the whole frame
+        at scene resolution. Each row still prefills its own copy of the
+        image tokens (generate() can't share KV state across rows), so
+        the scene resolution keeps that cost low. Batched questions don't
+        stream and don't use the prefix cache.
+        
+        Args:
+            questions: List of question strings
+            context: Context snapshot to answer from (defaults to the latest
+                of the first camera)
+        
+        Returns:
+            List of response texts, in the order of questions
+        """
+        if context is None:
+            context = self.get_context()
+        if context is None:
+            return [NO_CONTEXT_RESPONSE] * len(questions)
+        
+        frame = self.frame_buffers[context['source_id']].copy(context['frame_ref'])
+        if frame is None:
+            return [FRAME_EXPIRED_RESPONSE] * len(questions)
+        self.last_frame = (context['source_id'], context['frame_id'], frame)
+        
+        # One image for the whole batch
+        named = {frozenset(mentioned_classes(q, context['objects'])) for q in questions}
+        if len(named) == 1 or not VLM_ADAPTIVE_RESOLUTION:
+            pil_image, image_options, _, note = self.prepare_image(frame, context, questions[0])
+        else:
+            pil_image, image_options, note = (self.frame_to_pil(frame),
+                                              {'max_pixels': VLM_SCENE_MAX_PIXELS}, '')
+        image_inputs, _ = process_vision_info(self.build_messages(pil_image, "", **image_options))
+        
+        # Scene prompt and image are shared by all questions
+        text_context = build_vlm_prompt(context) + note
+        texts = [
+            self.processor.apply_chat_template(
+                self.build_messages(pil_image, f"{text_context}\n\n{question}", **image_options),
+                tokenize=False, add_generation_prompt=True
+            )
+            for question in questions
+        ]
+        
+        inputs = self.processor(
+            text=texts,
+            images=image_inputs * len(texts),
+            padding=True,
+            return_tensors="pt"
+        )
+        
+        inputs = inputs.to(self.device)
+        
+        return self._generate_batch(inputs)
+    
+    def query(self, question, context=None, on_token=None):
+        """
+        Answer a question using latest frame and context
+        
+        Args:
+            question: User's question string
+            context: Context snapshot to answer from (defaults to the latest
+                of the first camera)
+            on_token: Optional callback receiving text chunks as they are generated
+        
+        Returns:
+            Model's response text
+        """
+        if context is None:
+            context = self.get_context()
+        if context is None:
+            return NO_CONTEXT_RESPONSE
+        
+        # Copy frame out of shared memory, crop and size it for the question
+        frame = self.frame_buffers[context['source_id']].copy(context['frame_ref'])
+        if frame is None:
+            return FRAME_EXPIRED_RESPONSE
+        self.last_frame = (context['source_id'], context['frame_id'], frame)
+        pil_image, image_options, variant, note = self.prepare_image(frame, context, question)
+        
+        # Render text context from the context builder snapshot
+        text_context = build_vlm_prompt(context) + note
+        
+        messages = self.build_messages(pil_image, f"{text_context}\n\n{question}",
+                                       **image_options)
         
         # Process with Qwen-VL processor
         text = self.processor.apply_chat_template(
             messages, tokenize=False, add_generation_prompt=True
         )
         
+        # Reuse the image and scene prefill for follow-up questions
+        if self.prefix_cache is not None:
+            # Once text has been streamed a retry would repeat it
+            emitted = []
+            def on_cached_token(chunk):
+                emitted.append(chunk)
+                on_token(chunk)
+            
+            try:
+                inputs = self._prefix_cached_inputs(context, variant, messages,
+                                                    text, text_context)
+                return self._generate(inputs, on_cached_token if on_token else None)
+            except Exception as e:
+                if emitted:
+                    raise
+                print(f"⚠️  Prefix cache disabled, falling back to full prefill: {e}")
+                self.prefix_cache = None
+        
         image_inputs, video_inputs = process_vision_info(messages)
         
         inputs = self.processor(
@@ -99,7 +435,82 @@ class VLMHandler:
         
         inputs = inputs.to(self.device)
         
-        # Generate response
+        return self._generate(inputs, on_token)
+    
+    def _prefix_cached_inputs(self, context, variant, messages, text, text_context):
+        """
+        Build generate() inputs that start from a cached prefill of the
+        image and scene prompt, so only the question tokens are prefilled
+        """
+        # Split the chat text right after the scene prompt
+        split = text.rfind(f"{text_context}\n\n")
+        if split < 0:
+            raise ValueError("scene prompt not found in chat template output")
+        split += len(text_context) + 2
+        prefix_text, suffix_text = text[:split], text[split:]
+        
+        key = (context['source_id'], context['frame_id'], variant, hashlib.sha1(prefix_text.encode()).hexdigest())
+        entry = self.prefix_cache.get(key)
+        
+        if entry is None:
+            image_inputs, video_inputs = process_vision_info(messages)
+            prefix_inputs = self.processor(
+                text=[prefix_text],
+                images=image_inputs,
+                videos=video_inputs,
+                return_tensors="pt"
+            ).to(self.device)
+            
+            with torch.no_grad():
+                outputs = self.model(**prefix_inputs, use_cache=True)
+            
+            # Offset of text positions after the image in Qwen2-VL's M-RoPE
+            _, rope_deltas = self._get_rope_index(
+                prefix_inputs['input_ids'], prefix_inputs['image_grid_thw'],
+                None, prefix_inputs['attention_mask']
+            )
+            
+            entry = {
+                'inputs': prefix_inputs,
+                'past_key_values': outputs.past_key_values,
+                'rope_deltas': rope_deltas
+            }
+            self.prefix_cache.put(key, entry)
+        
+        suffix_ids = self.processor.tokenizer(
+            suffix_text, add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(self.device)
+        input_ids = torch.cat([entry['inputs']['input_ids'], suffix_ids], dim=1)
+        
+        # Newer transformers keep rope_deltas on the model instead of kwargs
+        for module in (self.model, getattr(self.model, 'model', None)):
+            if module is not None and hasattr(module, 'rope_deltas'):
+                module.rope_deltas = entry['rope_deltas']
+        
+        return {
+            'input_ids': input_ids,
+            'attention_mask': torch.ones_like(input_ids),
+            'pixel_values': entry['inputs']['pixel_values'],
+            'image_grid_thw': entry['inputs']['image_grid_thw'],
+            # generate() extends the cache in place, keep the cached copy clean
+            'past_key_values': copy.deepcopy(entry['past_key_values']),
+            'rope_deltas': entry['rope_deltas']
+        }
+    
+    def _get_rope_index(self, *args):
+        get_rope_index = getattr(self.model, 'get_rope_index', None)
+        if get_rope_index is None:
+            get_rope_index = self.model.model.get_rope_index
+        return get_rope_index(*args)
+    
+    def _generate(self, inputs, on_token=None):
+        """Run generation and decode the new tokens"""
+        if on_token is not None:
+            return self._generate_streaming(inputs, on_token)
+        return self._generate_batch(inputs)[0]
+    
+    def _generate_batch(self, inputs):
+        """Run generation and decode the new tokens of every row"""
         with torch.no_grad():
             generated_ids = self.model.generate(
                 **inputs,
@@ -108,56 +519,356 @@ class VLMHandler:
                 do_sample=True
             )
         
-        # Decode response
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
+        # Decode response (prompts are left-padded to the same length)
+        generated_ids_trimmed = generated_ids[:, inputs['input_ids'].shape[1]:]
         
-        response = self.processor.batch_decode(
+        return self.processor.batch_decode(
             generated_ids_trimmed,
             skip_special_tokens=True,
             clean_up_tokenization_spaces=False
-        )[0]
+        )
+    
+    def _generate_streaming(self, inputs, on_token):
+        """Run generation in a thread and pass text chunks to on_token as they arrive"""
+        streamer = TextIteratorStreamer(
+            self.processor.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )
+        errors = []
+        
+        def run():
+            try:
+                with torch.no_grad():
+                    self.model.generate(
+                        **inputs,
+                        streamer=streamer,
+                        max_new_tokens=VLM_MAX_TOKENS,
+                        temperature=VLM_TEMPERATURE,
+                        do_sample=True
+                    )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # Unblock the reader
         
-        return response
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        
+        chunks = []
+        for chunk in streamer:
+            if chunk:
+                chunks.append(chunk)
+                on_token(chunk)
+        
+        thread.join()
+        if errors:
+            raise errors[0]
+        
+        return ''.join(chunks)
 
 
 class VLMManager:
     """Manager to handle VLM in separate process"""
-    def __init__(self, context_queue, query_queue, response_queue):
-        self.context_queue = context_queue
+    def __init__(self, context_queues, query_queue, response_queue, frame_buffers,
+                 record_queue=None):
+        self.context_queues = context_queues
         self.query_queue = query_queue
         self.response_queue = response_queue
-        self.vlm = VLMHandler()
+        self.record_queue = record_queue  # Keyframe recorder, for answer audit trails
+        self.vlm = VLMHandler(frame_buffers)
+        self.tracker = LatencyTracker()
+        self.answer_cache = (AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS)
+                             if VLM_ANSWER_CACHE else None)
+        self.router = None
+        if QUERY_ROUTER:
+            # Read-only view of the history the context process writes
+            self.router = QueryRouter(HistoryStore(readonly=True) if HISTORY_ENABLED else None)
+        self.routed = 0  # Queries answered from detections alone
+        self.answered = set()  # Query ids of the current batch already answered
+    
+    def get_stats(self):
+        """Latency stats for the whole pipeline as seen from the VLM"""
+        stats = self.tracker.get_stats()
+        channels = [q for q in self.context_queues if isinstance(q, LatestValueChannel)]
+        if channels:
+            stats['contexts_dropped'] = sum(c.dropped for c in channels)
+            stats['context_staleness_ms'] = max(c.staleness for c in channels) * 1000
+        if self.router is not None:
+            stats['queries_answered_from_detections'] = self.routed
+        if self.answer_cache is not None:
+            stats['answer_cache_hits'] = self.answer_cache.hits
+            stats['answer_cache_misses'] = self.answer_cache.misses
+        return stats
+    
+    def _cache_key(self, query, context):
+        """Answer cache key for a query, or None when it can't be cached"""
+        if self.answer_cache is None or context is None:
+            return None
+        return (context['source_id'], context['scene_signature'],
+                normalize_question(query['question']))
+    
+    def _cache_answer(self, cache_key, response):
+        # Placeholder replies aren't answers about the scene
+        if cache_key is not None and response not in (NO_CONTEXT_RESPONSE, FRAME_EXPIRED_RESPONSE):
+            self.answer_cache.put(cache_key, response)
+    
+    def answer_from_detections(self, query):
+        """
+        Answer a structured question from the context snapshot, without the VLM
+        
+        Returns:
+            True if the router answered the query
+        """
+        if self.router is None:
+            return False
+        
+        context = self.vlm.get_context(query.get('source_id', 0))
+        response = self.router.route(query['question'], context)
+        if response is None:
+            return False
+        
+        self.routed += 1
+        frame_age = time.time() - context['timestamp']
+        self._send_response(query, response, context, frame_age,
+                            streamed=False, from_detections=True)
+        return True
+    
+    def answer(self, query):
+        """
+        Answer one query and send the result to the response queue
+        
+        Args:
+            query: Dict with 'query_id', 'question' and optional 'source_id'
+        """
+        question = query['question']
+        query_id = query.get('query_id')
+        print(f"\n🤔 Processing: {question}")
+        
+        # Answer from the newest context available when the query starts
+        context = self.vlm.get_context(query.get('source_id', 0))
+        query_start = time.time()
+        frame_age = query_start - context['timestamp'] if context else None
+        timing = {'query_start': query_start}
+        
+        # Same question on an unchanged scene, reuse the last answer
+        cache_key = self._cache_key(query, context)
+        if cache_key is not None:
+            response = self.answer_cache.get(cache_key)
+            if response is not None:
+                self._send_response(query, response, context, frame_age,
+                                    streamed=False, cached=True)
+                return
+        
+        # Push text chunks to the interface as they are generated
+        on_token = None
+        if VLM_STREAMING:
+            def on_token(text):
+                timing.setdefault('first_token', time.time())
+                self.response_queue.put({'type': 'token',
+                                         'query_id': query_id,
+                                         'text': text})
+        
+        # Generate response
+        response = self.vlm.query(question, context=context, on_token=on_token)
+        
+        if context:
+            self.tracker.record(dict(context['trace'], answer=time.time(), **timing),
+                                stages=QUERY_STAGES)
+        self._cache_answer(cache_key, response)
+        
+        self._send_response(query, response, context, frame_age,
+                            streamed='first_token' in timing)
+    
+    def answer_batch(self, queries):
+        """
+        Answer several queries about the same frame with one batched
+        generate() call and route each answer back by query id
+        
+        Args:
+            queries: List of dicts with 'query_id' and 'question', all for
+                the same camera source
+        """
+        context = self.vlm.get_context(queries[0].get('source_id', 0))
+        query_start = time.time()
+        frame_age = query_start - context['timestamp'] if context else None
+        
+        # Cached answers go out right away, the rest share one generate()
+        pending = []
+        for query in queries:
+            cache_key = self._cache_key(query, context)
+            response = self.answer_cache.get(cache_key) if cache_key is not None else None
+            if response is not None:
+                self._send_response(query, response, context, frame_age,
+                                    streamed=False, cached=True)
+            else:
+                pending.append((query, cache_key))
+        if not pending:
+            return
+        
+        print(f"\n🤔 Processing {len(pending)} questions as one batch")
+        responses = self.vlm.query_batch([q['question'] for q, _ in pending],
+                                         context=context)
+        
+        if context:
+            trace = dict(context['trace'], query_start=query_start, answer=time.time())
+            for _ in pending:
+                self.tracker.record(trace, stages=QUERY_STAGES)
+        
+        for (query, cache_key), response in zip(pending, responses):
+            self._cache_answer(cache_key, response)
+            self._send_response(query, response, context, frame_age, streamed=False)
+    
+    def _send_response(self, query, response, context, frame_age, streamed,
+                       cached=False, from_detections=False):
+        """Send an answer back to the user interface"""
+        self.answered.add(query.get('query_id'))
+        self.response_queue.put({
+            'type': 'response',
+            'query_id': query.get('query_id'),
+            'query': query['question'],
+            'response': response,
+            'streamed': streamed,
+            'cached': cached,
+            'from_detections': from_detections,
+            'source_id': context['source_id'] if context else None,
+            'frame_id': context['frame_id'] if context else None,
+            'frame_age': frame_age
+        })
+        self._record_keyframe(query, response, context)
+    
+    def _send_error(self, queries, error):
+        """Answer every query of a failed batch that is still waiting"""
+        print(f"⚠️  VLM query failed: {error}")
+        for query in queries:
+            if query.get('query_id') in self.answered:
+                continue
+            self.response_queue.put({
+                'type': 'response',
+                'query_id': query.get('query_id'),
+                'query': query['question'],
+                'response': ERROR_RESPONSE.format(error=error),
+                'error': True,
+                'streamed': False,
+                'cached': False,
+                'from_detections': False,
+                'source_id': query.get('source_id', 0),
+                'frame_id': None,
+                'frame_age': None
+            })
+    
+    def _record_keyframe(self, query, response, context):
+        """Send the frame an answer is about to the keyframe recorder"""
+        if self.record_queue is None or context is None or response == FRAME_EXPIRED_RESPONSE:
+            return
+        
+        # VLM answers already hold a copy, the slot may have been reused since
+        last = self.vlm.last_frame
+        if last is not None and last[:2] == (context['source_id'], context['frame_id']):
+            frame = last[2]
+        else:
+            frame = self.vlm.frame_buffers[context['source_id']].copy(context['frame_ref'])
+        if frame is None or self.record_queue.full():
+            return
+        
+        self.record_queue.put({
+            'source_id': context['source_id'],
+            'frame_id': context['frame_id'],
+            'timestamp': context['timestamp'],
+            'frame': frame,
+            'reason': 'query',
+            'objects': context['objects'],
+            'question': query['question'],
+            'answer': response
+        })
+    
+    def _send_stats(self):
+        self.response_queue.put({'type': 'stats', 'stats': self.get_stats()})
+    
+    def _collect_queries(self, first_query):
+        """
+        Gather queries arriving within VLM_BATCH_WINDOW_MS of the first one,
+        up to VLM_MAX_BATCH_SIZE
+        """
+        batch = [first_query]
+        deadline = time.time() + VLM_BATCH_WINDOW_MS / 1000.0
+        
+        while len(batch) < VLM_MAX_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                query = self.query_queue.get(timeout=remaining)
+            except:
+                break
+            
+            if query.get('type') == 'stats':
+                self._send_stats()
+            else:
+                batch.append(query)
+        
+        return batch
+    
+    def _receive_contexts(self, stop_event):
+        """
+        Receiver thread: keep pulling context while the main thread is
+        busy generating, so upstream stages never back up behind the VLM
+        """
+        # Read the cameras in turn so a busy one can't hide the others
+        context_queue = RoundRobinReader(self.context_queues)
+        
+        while not stop_event.is_set():
+            try:
+                context_data = context_queue.get(timeout=0.1)
+            except:
+                continue
+            
+            stamp(context_data, 'vlm_received')
+            self.tracker.record(context_data['trace'])
+            self.tracker.throughput.tick()
+            self.vlm.update_context(context_data)
     
     def run(self, stop_event):
         """Main loop for VLM process"""
         self.vlm.initialize()
+        
+        receiver = threading.Thread(target=self._receive_contexts,
+                                    args=(stop_event,), daemon=True)
+        receiver.start()
         print("✓ VLM ready for queries")
         
         try:
             while not stop_event.is_set():
-                # Update context continuously from context builder
+                # Wait for user queries, context arrives on the receiver thread
                 try:
-                    context_data = self.context_queue.get(timeout=0.1)
-                    self.vlm.update_context(context_data)
-                except:
-                    pass
-                
-                # Check for user queries
-                try:
-                    query = self.query_queue.get_nowait()
-                    print(f"\n🤔 Processing: {query}")
+                    query = self.query_queue.get(timeout=0.1)
+                    
+                    # Local commands from the interface
+                    if query.get('type') == 'stats':
+                        self._send_stats()
+                        continue
                     
-                    # Generate response
-                    response = self.vlm.query(query)
+                    # A lone query keeps streaming and the prefix cache,
+                    # concurrent ones about the same camera share a single
+                    # batched generate()
+                    by_source = {}
+                    for q in self._collect_queries(query):
+                        # Simple questions never reach the model
+                        if self.answer_from_detections(q):
+                            continue
+                        by_source.setdefault(q.get('source_id', 0), []).append(q)
                     
-                    # Send back to user interface
-                    self.response_queue.put({
-                        'query': query,
-                        'response': response,
-                        'frame_id': self.vlm.latest_context['frame_id'] if self.vlm.latest_context else None
-                    })
+                    for batch in by_source.values():
+                        # A failed generate() must not take the other
+                        # cameras' questions down with it
+                        self.answered.clear()
+                        try:
+                            if len(batch) == 1:
+                                self.answer(batch[0])
+                            else:
+                                self.answer_batch(batch)
+                        except Exception as e:
+                            self._send_error(batch, e)
                     
                 except:
                     pass
@@ -165,18 +876,23 @@ class VLMManager:
         except KeyboardInterrupt:
             pass
         finally:
+            receiver.join(timeout=1)
             print("✓ VLM stopped")
 
 
-def vlm_process(context_queue, query_queue, response_queue, stop_event):
+def vlm_process(context_queues, query_queue, response_queue, frame_buffers, stop_event,
+                record_queue=None):
     """
     Process function to run VLM in separate process
     
     Args:
-        context_queue: Queue receiving context from context builder
+        context_queues: Queue per camera source receiving context from context builder
         query_queue: Queue receiving questions from user interface
         response_queue: Queue to send answers back to user interface
+        frame_buffers: SharedFrameBuffer per camera source
         stop_event: Event to signal when to stop
+        record_queue: Optional queue to the keyframe recorder
     """
-    manager = VLMManager(context_queue, query_queue, response_queue)
+    manager = VLMManager(context_queues, query_queue, response_queue, frame_buffers,
+                         record_queue)
     manager.run(stop_event)
\ No newline at end of file